@@ -1,13 +1,19 @@
 from __future__ import annotations
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from functools import lru_cache
 from math import sqrt
 from pathlib import Path
-from typing import List, Optional, Dict, Any, Iterable, Tuple
-import json
+from typing import List, Optional, Dict, Any, FrozenSet, Iterable, Iterator, Tuple
+import hashlib
+import heapq
+import re
+import sys
+import threading
+import time
 import cv2
+import numpy as np
 import shutil
 
 try:
@@ -15,15 +21,43 @@ try:
 except ImportError:  # pragma: no cover - depende de lib opcional
     PPStructure = None  # type: ignore
 
+from .json_utils import dumps, write_json_pretty
 from .logging_utils import get_logger
-from .llm_vision import call_openai_vision_json, to_table_from_llm_payload, quick_precheck_with_cheap_llm
+from .llm_vision import (
+    call_openai_vision_json,
+    call_openai_vision_json_batch,
+    run_llm_coroutine,
+    to_table_from_llm_payload,
+    quick_precheck_batch,
+    quick_precheck_grouped,
+    quick_precheck_with_cheap_llm,
+)
 from .pdf_utils import open_document, parse_pages, render_pages
+from .text_extraction import extract_text_batch
 
 
 logger = get_logger(__name__)
 
+# Pool para gravação de Excel/HTML em background (pandas/openpyxl), para que a
+# escrita dos arquivos não serialize com as chamadas ao LLM das páginas.
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="extractor-io")
+
+# Recortes enviados à LLM: JPEG q90 codifica bem mais rápido que PNG num recorte a 900 DPI
+# e o libjpeg decodifica já reduzido no envio (ver llm_vision._img_to_data_url)
+_SEGMENT_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 90]
+# A partir deste DPI a página é lida pela metade (IMREAD_REDUCED_COLOR_2) para recortar:
+# o recorte continua com >= 200 DPI, acima do que o modelo de visão aproveita
+_REDUCED_DECODE_MIN_DPI = 400
+_SEGMENT_WRITE_MAX_WORKERS = 4  # threads para gravar os recortes de uma página
+
 _layout_engine_warning_emitted = False
 _SUPPORTED_LAYOUT_LANGS = {"en", "ch"}
+# PPStructure por idioma normalizado (ver _get_layout_engine); RLock: o preload o chama com o lock
+_LAYOUT_ENGINES: Dict[str, Any] = {}
+_LAYOUT_ENGINE_LOCK = threading.RLock()
+# O predictor do Paddle não é thread-safe: as páginas em paralelo compartilham o engine
+# (pesos carregados uma vez) e fazem a inferência de layout uma de cada vez
+_LAYOUT_INFER_LOCK = threading.Lock()
 
 
 def _layout_engine_available() -> bool:
@@ -39,6 +73,8 @@ def _layout_engine_available() -> bool:
     return True
 
 
+# Poucos idiomas distintos por execução; de quebra, o aviso de idioma não suportado sai uma vez só
+@lru_cache(maxsize=8)
 def _normalize_ocr_lang(lang: str) -> str:
     lang = (lang or "en").strip().lower()
     if lang in _SUPPORTED_LAYOUT_LANGS:
@@ -51,28 +87,53 @@ def _normalize_ocr_lang(lang: str) -> str:
     return "en"
 
 
-@lru_cache(maxsize=2)
 def _get_layout_engine(lang: str) -> "PPStructure":  # type: ignore[name-defined]
     """Retorna instância cacheada do PPStructure para o idioma especificado."""
     if PPStructure is None:  # pragma: no cover - guard
         raise RuntimeError("PPStructure não disponível")
     normalized_lang = _normalize_ocr_lang(lang)
-    logger.info("Inicializando PPStructure (lang=%s)", normalized_lang)
-    return PPStructure(
-        show_log=False,
-        layout=True,
-        ocr=True,
-        table=True,
-        recover_table=True,
-        lang=normalized_lang,
-    )
+    engine = _LAYOUT_ENGINES.get(normalized_lang)
+    if engine is not None:
+        return engine
+    # Lock: páginas em paralelo (ou o preload) não carregam o modelo duas vezes
+    with _LAYOUT_ENGINE_LOCK:
+        engine = _LAYOUT_ENGINES.get(normalized_lang)
+        if engine is None:
+            logger.info("Inicializando PPStructure (lang=%s)", normalized_lang)
+            engine = PPStructure(
+                show_log=False,
+                layout=True,
+                ocr=True,
+                table=True,
+                recover_table=True,
+                lang=normalized_lang,
+            )
+            _LAYOUT_ENGINES[normalized_lang] = engine
+    return engine
 
 
-def _reset_layout_engine_cache() -> None:
+def preload_layout_engine(lang: str) -> None:
+    """
+    Carrega o PPStructure e roda uma inferência de aquecimento numa imagem vazia, para a
+    primeira página segmentada não pagar a inicialização (2-5s). Feito sob o lock do
+    modelo: quem pedir o engine nesse meio-tempo espera o aquecimento terminar.
+    """
+    if PPStructure is None:
+        return
     try:
-        _get_layout_engine.cache_clear()  # type: ignore[attr-defined]
-    except AttributeError:
-        pass
+        with _LAYOUT_ENGINE_LOCK:
+            engine = _get_layout_engine(lang)
+            started = time.perf_counter()
+            with _LAYOUT_INFER_LOCK:
+                engine(np.full((64, 64, 3), 255, dtype=np.uint8))
+        logger.info("🔥 PPStructure pré-carregado (aquecimento em %.1fs)", time.perf_counter() - started)
+    except Exception as exc:  # pragma: no cover - depende de lib externa
+        logger.warning("Pré-carregamento do PPStructure falhou (%s); segue sob demanda", exc)
+
+
+def _reset_layout_engine_cache() -> None:
+    with _LAYOUT_ENGINE_LOCK:
+        _LAYOUT_ENGINES.clear()
 
 
 def _cleanup_paddle_structure_cache(lang: str) -> None:
@@ -184,6 +245,46 @@ SEGMENT_TABLE_PROMPT = """Esta imagem é um recorte contendo EXATAMENTE 1 tabela
 Retorne somente JSON válido."""
 
 
+# Schemas estritos (Structured Outputs) dos prompts de tabela em HTML; ver llm_vision.PRECHECK_SCHEMA
+_HTML_TABLE_PROPERTIES = {
+    "title": {"type": "string"},
+    "format": {"type": "string", "enum": ["html"]},
+    "html": {"type": "string"},
+    "notes": {"type": ["string", "null"]},
+}
+
+PAGE_TABLE_SCHEMA = {
+    "name": "table_set",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "type": {"type": "string", "enum": ["table_set"]},
+            "tables": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": _HTML_TABLE_PROPERTIES,
+                    "required": list(_HTML_TABLE_PROPERTIES),
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["type", "tables"],
+        "additionalProperties": False,
+    },
+}
+
+SEGMENT_TABLE_SCHEMA = {
+    "name": "table",
+    "schema": {
+        "type": "object",
+        "properties": {"type": {"type": "string", "enum": ["table"]}, **_HTML_TABLE_PROPERTIES},
+        "required": ["type", *_HTML_TABLE_PROPERTIES],
+        "additionalProperties": False,
+    },
+}
+
+
 @dataclass
 class ImageProcessingConfig:
     model: str
@@ -199,13 +300,27 @@ class ImageProcessingConfig:
     cheap_azure_api_version: Optional[str] = None
     locale: str = "pt-BR"
     render_dpi: int = 600
+    render_max_workers: Optional[int] = None  # processos de rasterização (None: um por núcleo)
     use_cheap_precheck: bool = True
+    precheck_batch: bool = False  # pre-check via Batch API (offline, ~50% do custo)
     llm_max_workers: int = 6
+    precheck_max_workers: int = 8  # pre-checks simultâneos (limite de taxa do modelo barato)
+    precheck_group_size: int = 1  # páginas por requisição de pre-check (várias imagens na mesma mensagem)
     use_layout_ocr: bool = True
     ocr_lang: str = "en"
     segment_padding: int = 16
     max_segments: Optional[int] = None
     fallback_to_full_page: bool = True
+    preload_layout: bool = False  # carrega/aquece o PPStructure em background durante a renderização
+    skip_ocr_pages: FrozenSet[int] = frozenset()
+    debug_llm: bool = False  # grava o JSON bruto de cada segmento (segment-XX.json)
+    force_reprocess: bool = False  # FORCE_REPROCESS (o cache de respostas da LLM continua valendo)
+    convert_text_only: bool = False  # converte páginas text-only em HTML (CONVERT_TEXT_ONLY)
+    text_group_size: int = 4  # páginas text-only por requisição (várias imagens na mesma mensagem)
+
+    def __post_init__(self) -> None:
+        # Consulta por página é O(1); aceita qualquer iterável (lista do .env, etc)
+        self.skip_ocr_pages = frozenset(int(p) for p in (self.skip_ocr_pages or ()))
 
 
 @dataclass
@@ -245,9 +360,19 @@ def process_pdf_images(
     results: List[Path] = []
     summary_entries: List[Dict[str, str]] = []
 
+    if config.preload_layout and config.use_layout_ocr and _layout_engine_available():
+        # Inicialização do modelo em paralelo com a renderização das páginas
+        _IO_POOL.submit(preload_layout_engine, config.ocr_lang)
+
     # SEMPRE renderiza páginas completas (sem extrair imagens embutidas)
     logger.info("Renderizando %d páginas em DPI %d", len(page_nums), config.render_dpi)
-    page_imgs = render_pages(doc, output_dir / "pages", page_nums, dpi=config.render_dpi)
+    page_imgs = render_pages(
+        doc,
+        output_dir / "pages",
+        page_nums,
+        dpi=config.render_dpi,
+        max_workers=config.render_max_workers,
+    )
     
     # Processa páginas (em paralelo se configurado)
     results.extend(
@@ -275,28 +400,90 @@ def _process_rasterized_pages(
         return outputs
 
     max_workers = max(1, config.llm_max_workers)
+    prechecks = _batch_precheck(page_images, config)
+    # Páginas text-only a converter (CONVERT_TEXT_ONLY): ficam para o fim, em grupos
+    text_pages: List[Tuple[Path, Path, str]] = []
     
     if max_workers <= 1 or len(page_images) == 1:
         # Processa sequencialmente
         for page in page_images:
             page_outputs, page_summary = _process_single_page(
-                page, tables_dir, config
+                page, tables_dir, config, prechecks.get(page.page_number), text_pages
             )
             outputs.extend(page_outputs)
             summary_entries.extend(page_summary)
+        outputs.extend(_extract_text_pages(text_pages, config, summary_entries))
         return outputs
 
-    # Processa em paralelo
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    # Processa em paralelo. Os pre-checks que não vieram do lote rodam num pool próprio
+    # e cada página entra na extração assim que o seu termina, sem esperar vaga atrás
+    # das extrações longas.
+    pending = [page for page in page_images if page.page_number not in prechecks]
+    precheck_workers = max(1, min(config.precheck_max_workers, len(pending) or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, ThreadPoolExecutor(
+        max_workers=precheck_workers, thread_name_prefix="extractor-precheck"
+    ) as precheck_pool:
         futures = [
-            executor.submit(_process_single_page, page, tables_dir, config)
+            executor.submit(
+                _process_single_page, page, tables_dir, config, prechecks[page.page_number], text_pages
+            )
             for page in page_images
+            if page.page_number in prechecks
         ]
+        group_size = max(1, config.precheck_group_size)
+        precheck_futures = {
+            precheck_pool.submit(_page_group_precheck, group, config): group
+            for group in (pending[i : i + group_size] for i in range(0, len(pending), group_size))
+        }
+        for precheck_future in as_completed(precheck_futures):
+            group = precheck_futures[precheck_future]
+            for page, precheck in zip(group, precheck_future.result()):
+                futures.append(
+                    executor.submit(_process_single_page, page, tables_dir, config, precheck, text_pages)
+                )
         for future in as_completed(futures):
             page_outputs, page_summary = future.result()
             outputs.extend(page_outputs)
             summary_entries.extend(page_summary)
-    
+
+    outputs.extend(_extract_text_pages(text_pages, config, summary_entries))
+    return outputs
+
+
+def _extract_text_pages(
+    text_pages: List[Tuple[Path, Path, str]],
+    config: ImageProcessingConfig,
+    summary_entries: List[Dict[str, str]],
+) -> List[Path]:
+    """Converte as páginas text-only em HTML, `text_group_size` páginas por requisição."""
+    outputs: List[Path] = []
+    if not text_pages:
+        return outputs
+
+    text_pages.sort(key=lambda item: item[2])
+    size = max(1, config.text_group_size)
+    groups = [text_pages[i : i + size] for i in range(0, len(text_pages), size)]
+    logger.info("📄 %d página(s) text-only em %d requisição(ões)", len(text_pages), len(groups))
+
+    def _run(group: List[Tuple[Path, Path, str]]):
+        return extract_text_batch(
+            group,
+            config.model,
+            config.provider,
+            config.api_key,
+            config.azure_endpoint,
+            config.azure_api_version,
+            config.openrouter_api_key,
+            config.locale,
+        )
+
+    with ThreadPoolExecutor(max_workers=min(max(1, config.llm_max_workers), len(groups))) as executor:
+        for results in executor.map(_run, groups):
+            for html_path, summary_entry in results:
+                if html_path:
+                    outputs.append(html_path)
+                if summary_entry:
+                    summary_entries.append(summary_entry)
     return outputs
 
 
@@ -304,8 +491,13 @@ def _process_single_page(
     page,
     tables_dir: Path,
     config: ImageProcessingConfig,
+    precheck: Optional[Tuple[bool, str, int]] = None,
+    text_pages: Optional[List[Tuple[Path, Path, str]]] = None,
 ) -> tuple[List[Path], List[Dict[str, str]]]:
-    """Processa uma única página: pre-check + extração se necessário"""
+    """
+    Processa uma única página: pre-check (se não veio pronto do lote) + extração se necessário.
+    Páginas text-only com convert_text_only entram em `text_pages` (convertidas em grupo no fim).
+    """
     page_outputs: List[Path] = []
     page_summary: List[Dict[str, str]] = []
     page_id = f"{page.page_number:03d}"
@@ -313,17 +505,19 @@ def _process_single_page(
     page_out = tables_dir / f"page-{page.page_number:03d}"
     page_out.mkdir(parents=True, exist_ok=True)
 
-    # Copia imagem da página para o diretório de saída
+    # Copia imagem da página para o diretório de saída: cópia dos bytes do PNG já
+    # rasterizado, sem decodificar e recodificar a página inteira
     full_page_path = page_out / "page-full.png"
-    bgr = cv2.imread(page.path.as_posix())
-    if bgr is None:
-        logger.warning("Falha ao carregar imagem da página %s", page.page_number)
+    try:
+        shutil.copyfile(page.path, full_page_path)
+    except OSError as exc:
+        logger.warning("Falha ao copiar imagem da página %s: %s", page.page_number, exc)
         return page_outputs, page_summary
-    
-    cv2.imwrite(full_page_path.as_posix(), bgr)
 
     # ETAPA 1: Pre-check com LLM barata (identifica tipo e quantidade)
-    has_content, content_type, content_count = _page_level_precheck(full_page_path, config)
+    if precheck is None:
+        precheck = _page_level_precheck(full_page_path, config)
+    has_content, content_type, content_count = precheck
     logger.info(
         "📋 Pre-check → has_content=%s | type=%s | count=%s",
         has_content,
@@ -332,6 +526,10 @@ def _process_single_page(
     )
     
     if not has_content:
+        if content_type == "text_only" and config.convert_text_only and text_pages is not None:
+            logger.info("Página %s: text-only, texto será convertido em HTML", page.page_number)
+            text_pages.append((full_page_path, page_out, page_id))
+            return page_outputs, page_summary
         logger.info(
             "Página %s: sem conteúdo útil (type=%s), pulando",
             page.page_number,
@@ -351,6 +549,7 @@ def _process_single_page(
         full_page_path,
         page_out,
         page_id,
+        page.page_number,
         config,
         content_type,
         content_count,
@@ -362,6 +561,51 @@ def _process_single_page(
     return page_outputs, page_summary
 
 
+def _batch_precheck(
+    page_images,
+    config: ImageProcessingConfig,
+) -> Dict[int, Tuple[bool, str, int]]:
+    """Pre-check de todas as páginas num único lote (Batch API), se habilitado."""
+    if not (config.precheck_batch and config.use_cheap_precheck and config.cheap_model):
+        return {}
+    if len(page_images) < 2:
+        return {}
+
+    logger.info("📦 Pre-check em lote para %d páginas (pode levar minutos)", len(page_images))
+    results = quick_precheck_batch(
+        [page.path for page in page_images],
+        config.cheap_model,
+        config.cheap_provider or config.provider,
+        config.openrouter_api_key,
+        api_key=config.cheap_api_key,
+        azure_endpoint=config.cheap_azure_endpoint,
+        azure_api_version=config.cheap_azure_api_version,
+    )
+    return {page.page_number: result for page, result in zip(page_images, results)}
+
+
+def _page_group_precheck(
+    pages,
+    config: ImageProcessingConfig,
+) -> List[Tuple[bool, str, int]]:
+    """Pre-check de um grupo de páginas: uma requisição só se precheck_group_size > 1."""
+    if len(pages) == 1 or not (config.use_cheap_precheck and config.cheap_model):
+        return [_page_level_precheck(page.path, config) for page in pages]
+    try:
+        return quick_precheck_grouped(
+            [page.path for page in pages],
+            config.cheap_model,
+            config.cheap_provider or config.provider,
+            config.openrouter_api_key,
+            api_key=config.cheap_api_key,
+            azure_endpoint=config.cheap_azure_endpoint,
+            azure_api_version=config.cheap_azure_api_version,
+        )
+    except Exception as exc:
+        logger.warning("Pre-check agrupado falhou (%s); assumindo conteúdo", exc)
+        return [(True, "unknown", 1)] * len(pages)
+
+
 def _page_level_precheck(
     image_path: Path,
     config: ImageProcessingConfig,
@@ -413,10 +657,15 @@ def _segment_page_elements(
     if not _layout_engine_available():
         return []
 
-    bgr = cv2.imread(page_image_path.as_posix())
+    # Em DPI alto decodifica já reduzido (metade da resolução, 1/4 dos pixels) e o layout
+    # roda nessa imagem; os bboxes voltam à resolução original e são escalados no recorte
+    reduce = 2 if config.render_dpi >= _REDUCED_DECODE_MIN_DPI else 1
+    read_flag = cv2.IMREAD_REDUCED_COLOR_2 if reduce == 2 else cv2.IMREAD_COLOR
+    bgr = cv2.imread(page_image_path.as_posix(), read_flag)
     if bgr is None:
         logger.warning("PPStructure: falha ao carregar imagem %s", page_image_path)
         return []
+    page_height, page_width = bgr.shape[0] * reduce, bgr.shape[1] * reduce
 
     normalized_lang = _normalize_ocr_lang(config.ocr_lang)
 
@@ -448,7 +697,9 @@ def _segment_page_elements(
                 normalized_lang,
                 attempt,
             )
-            layout_results = engine(page_image_path.as_posix())
+            # Inferência sobre a imagem já decodificada (o PPStructure releria o PNG do disco)
+            with _LAYOUT_INFER_LOCK:
+                layout_results = engine(bgr)
             break
         except Exception as exc:  # pragma: no cover - depende de lib externa
             logger.error("PPStructure falhou (tentativa %d): %s", attempt, exc)
@@ -466,15 +717,18 @@ def _segment_page_elements(
         return []
 
     segments: List[SegmentedElement] = []
-    keep_types = _layout_types_for_content(content_type)
+    keep_types = _LAYOUT_TYPES_BY_CONTENT.get(content_type, _DEFAULT_LAYOUT_TYPES)
 
     if not isinstance(layout_results, list):
         logger.warning("PPStructure retornou formato inesperado (%s)", type(layout_results))
         return []
 
+    # Filtra primeiro e aplica padding/limites de todos os bboxes de uma vez (Nx4)
+    kept: List[Tuple[str, Any]] = []
+    raw_bboxes: List[List[int]] = []
     for item in layout_results:
         layout_type = str(item.get("type", "")).lower()
-        mapped_type = _map_layout_type(layout_type)
+        mapped_type = _LAYOUT_TYPE_MAP.get(layout_type)
         if mapped_type is None:
             continue
         if keep_types and mapped_type not in keep_types:
@@ -483,28 +737,31 @@ def _segment_page_elements(
         bbox = item.get("bbox")
         if not bbox or len(bbox) != 4:
             continue
-        x1, y1, x2, y2 = [int(v) for v in bbox]
-        padded_bbox = _apply_padding_to_bbox(
-            (x1, y1, x2, y2),
-            bgr.shape[1],
-            bgr.shape[0],
-            config.segment_padding,
-        )
-        crop = _crop_image(bgr, padded_bbox)
+        kept.append((mapped_type, item.get("score")))
+        raw_bboxes.append([int(v * reduce) for v in bbox])
+
+    padded_bboxes = _pad_bboxes(raw_bboxes, page_width, page_height, config.segment_padding)
+    crop_bboxes = padded_bboxes // reduce if reduce != 1 else padded_bboxes
+
+    crops: List[Tuple[Path, Any]] = []
+    for (mapped_type, score), padded_bbox, crop_bbox in zip(
+        kept, padded_bboxes.tolist(), crop_bboxes.tolist()
+    ):
+        crop = _crop_image(bgr, crop_bbox)
         if crop is None:
             continue
 
         seg_idx = len(segments) + 1
-        seg_path = page_out / f"segment-{seg_idx:02d}.png"
-        cv2.imwrite(seg_path.as_posix(), crop)
+        seg_path = page_out / f"segment-{seg_idx:02d}.jpg"
+        crops.append((seg_path, crop))
 
         segments.append(
             SegmentedElement(
                 element_type=mapped_type,
                 image_path=seg_path,
-                bbox=padded_bbox,
+                bbox=tuple(padded_bbox),
                 index=seg_idx,
-                score=item.get("score"),
+                score=score,
             )
         )
 
@@ -515,6 +772,8 @@ def _segment_page_elements(
         logger.info("PPStructure não encontrou segmentos relevantes (%s)", content_type)
         return []
 
+    _write_segment_images(crops)
+
     if expected_count and len(segments) != expected_count:
         logger.info(
             "PPStructure detectou %d elemento(s) vs pre-check %d",
@@ -526,37 +785,47 @@ def _segment_page_elements(
     return segments
 
 
-def _layout_types_for_content(content_type: str) -> set[str]:
-    mapping = {
-        "table": {"table"},
-        "chart": {"chart"},
-        "mixed": {"table", "chart"},
-    }
-    return mapping.get(content_type, {"table", "chart"})
-
-
-def _map_layout_type(layout_type: str) -> Optional[str]:
-    if layout_type == "table":
-        return "table"
-    if layout_type in {"figure", "chart", "graphic"}:
-        return "chart"
-    return None
+# Tipos de layout aceitos por tipo de conteúdo do pre-check (padrão: tabelas e gráficos)
+_LAYOUT_TYPES_BY_CONTENT: Dict[str, FrozenSet[str]] = {
+    "table": frozenset({"table"}),
+    "chart": frozenset({"chart"}),
+    "mixed": frozenset({"table", "chart"}),
+}
+_DEFAULT_LAYOUT_TYPES: FrozenSet[str] = frozenset({"table", "chart"})
+# Tipo de layout do PaddleOCR (minúsculo) -> tipo interno
+_LAYOUT_TYPE_MAP: Dict[str, str] = {
+    "table": "table",
+    "figure": "chart",
+    "chart": "chart",
+    "graphic": "chart",
+}
 
 
-def _apply_padding_to_bbox(
-    bbox: Tuple[int, int, int, int],
+def _pad_bboxes(
+    bboxes: List[List[int]],
     width: int,
     height: int,
     padding: int,
-) -> Tuple[int, int, int, int]:
-    if padding <= 0:
-        return bbox
-    x1, y1, x2, y2 = bbox
-    x1 = max(0, x1 - padding)
-    y1 = max(0, y1 - padding)
-    x2 = min(width, x2 + padding)
-    y2 = min(height, y2 + padding)
-    return x1, y1, x2, y2
+) -> np.ndarray:
+    """Adiciona padding aos bboxes (x1, y1, x2, y2) sem ultrapassar os limites da imagem."""
+    boxes = np.asarray(bboxes, dtype=np.int32).reshape(-1, 4)
+    if padding > 0:
+        boxes = boxes + np.array([-padding, -padding, padding, padding], dtype=np.int32)
+    return np.clip(boxes, 0, np.array([width, height, width, height], dtype=np.int32))
+
+
+def _write_segment_image(path: Path, image: "cv2.Mat") -> None:  # type: ignore[name-defined]
+    cv2.imwrite(path.as_posix(), image, _SEGMENT_JPEG_PARAMS)
+
+
+def _write_segment_images(crops: List[Tuple[Path, Any]]) -> None:
+    """Codifica e grava os recortes da página em paralelo (o imwrite do OpenCV libera o GIL)."""
+    if len(crops) == 1:
+        _write_segment_image(*crops[0])
+        return
+    with ThreadPoolExecutor(max_workers=min(_SEGMENT_WRITE_MAX_WORKERS, len(crops))) as executor:
+        # list(): propaga exceções de gravação como no laço serial
+        list(executor.map(_write_segment_image, *zip(*crops)))
 
 
 def _crop_image(
@@ -646,6 +915,8 @@ def _run_segmented_flow(
     total = len(segments)
     combined_entries: List[Dict[str, Any]] = []
 
+    requests: List[Tuple[Path, Optional[str]]] = []
+    schemas: List[Optional[Dict[str, Any]]] = []
     for segment in segments:
         instructions = _prompt_for_segment(segment, total)
         logger.info(
@@ -659,8 +930,14 @@ def _run_segmented_flow(
             segment.index,
             instructions,
         )
-        payload = call_openai_vision_json(
-            segment.image_path,
+        requests.append((segment.image_path, instructions))
+        schemas.append(SEGMENT_TABLE_SCHEMA if segment.element_type == "table" else None)
+
+    # Os segmentos são independentes: dispara todas as chamadas de uma vez (asyncio.gather),
+    # no loop de fundo compartilhado pelas páginas (mesmo cliente, limite global em voo)
+    payloads = run_llm_coroutine(
+        call_openai_vision_json_batch(
+            requests,
             model=config.model,
             provider=config.provider,
             api_key=config.api_key,
@@ -668,10 +945,12 @@ def _run_segmented_flow(
             azure_api_version=config.azure_api_version,
             openrouter_api_key=config.openrouter_api_key,
             locale=config.locale,
-            instructions=instructions,
             max_retries=2,
+            json_schemas=schemas,
         )
+    )
 
+    for segment, payload in zip(segments, payloads):
         if not payload:
             logger.warning(
                 "Segmento %02d (%s) não retornou dados, ignorando.",
@@ -685,10 +964,12 @@ def _run_segmented_flow(
             segment.index,
             len(payload.keys()) if isinstance(payload, dict) else 0,
         )
-        (page_out / f"segment-{segment.index:02d}.json").write_text(
-            _json_dumps(payload),
-            encoding="utf-8",
-        )
+        if config.debug_llm:
+            # Só depuração: o conteúdo já vai consolidado para page-full.json
+            (page_out / f"segment-{segment.index:02d}.json").write_text(
+                dumps(payload),
+                encoding="utf-8",
+            )
 
         entries = _segment_payload_to_entries(payload)
         if not entries:
@@ -743,6 +1024,7 @@ def _call_full_page_llm(
         "elemento(s)",
     )
 
+    json_schema: Optional[Dict[str, Any]] = None
     if content_type == "chart":
         prompt = CHART_PROMPT
     elif content_type == "mixed":
@@ -772,6 +1054,7 @@ Retorne TODAS as {content_count} elementos como entradas separadas no array "tab
     else:
         count_desc = _format_count_description("table", content_count or 1)
         prompt = PAGE_TABLE_PROMPT.format(count_desc=count_desc)
+        json_schema = PAGE_TABLE_SCHEMA
 
     return call_openai_vision_json(
         page_image_path,
@@ -784,6 +1067,7 @@ Retorne TODAS as {content_count} elementos como entradas separadas no array "tab
         locale=config.locale,
         instructions=prompt,
         max_retries=2,
+        json_schema=json_schema,
     )
 
 
@@ -791,6 +1075,7 @@ def _llm_page_to_tables(
     page_image_path: Path,
     page_out: Path,
     page_id: str,
+    page_num: int,
     config: ImageProcessingConfig,
     content_type: str,
     content_count: int,
@@ -800,23 +1085,29 @@ def _llm_page_to_tables(
     """
     outputs: List[Path] = []
     summaries: List[Dict[str, str]] = []
+    # Gravações de Excel/HTML submetidas ao _IO_POOL: (future, base_name, xlsx, só_se_existir)
+    pending: List[Tuple[Future, str, Path, bool]] = []
 
     needs_review = content_count > 2
     expected_elements = max(1, content_count)
 
     payload: Optional[Dict[str, Any]] = None
-    logger.info(
-        "🧪 Iniciando segmentação PaddleOCR (type=%s, esperado=%d)",
-        content_type,
-        expected_elements,
-    )
-    segments = _segment_page_elements(
-        page_image_path,
-        page_out,
-        config,
-        content_type,
-        expected_elements,
-    )
+    segments: List[SegmentedElement] = []
+    if page_num in config.skip_ocr_pages:
+        logger.info("⏭️  Página %s em skip_ocr_pages - pulando segmentação PaddleOCR", page_id)
+    else:
+        logger.info(
+            "🧪 Iniciando segmentação PaddleOCR (type=%s, esperado=%d)",
+            content_type,
+            expected_elements,
+        )
+        segments = _segment_page_elements(
+            page_image_path,
+            page_out,
+            config,
+            content_type,
+            expected_elements,
+        )
 
     if segments:
         logger.info("📐 Fluxo segmentado: %d recorte(s) identificado(s)", len(segments))
@@ -857,7 +1148,7 @@ def _llm_page_to_tables(
     elif payload.get("mode") is None:
         payload["mode"] = "fullpage"
 
-    (page_out / "page-full.json").write_text(_json_dumps(payload), encoding="utf-8")
+    write_json_pretty(page_out / "page-full.json", payload)
 
     if needs_review:
         extracted_count = len(_extract_tables_from_payload(payload))
@@ -919,10 +1210,13 @@ ARQUIVOS PARA CONFERIR:
         rows = _augment_rows_with_quadratic_metrics(rows)
 
         base_name = "chart-01"
-        html = _save_table_outputs(rows, page_out, base_name)
-        outputs.append(page_out / f"{base_name}.xlsx")
-        if html:
-            summaries.append({"page": page_id, "table": base_name, "html": html})
+        pending.append((
+            _IO_POOL.submit(_save_table_outputs, rows, page_out, base_name),
+            base_name,
+            page_out / f"{base_name}.xlsx",
+            False,
+        ))
+        _resolve_pending_saves(pending, page_id, outputs, summaries)
         return outputs, summaries
 
     # Tabela(s)
@@ -933,10 +1227,13 @@ ARQUIVOS PARA CONFERIR:
         if not rows:
             logger.warning("Nenhuma tabela interpretável em página %s", page_id)
             return outputs, summaries
-        html = _save_table_outputs(rows, page_out, "table-01", notes=payload.get("notes"))
-        outputs.append(page_out / "table-01.xlsx")
-        if html:
-            summaries.append({"page": page_id, "table": "table-01", "html": html})
+        pending.append((
+            _IO_POOL.submit(_save_table_outputs, rows, page_out, "table-01", notes=payload.get("notes")),
+            "table-01",
+            page_out / "table-01.xlsx",
+            False,
+        ))
+        _resolve_pending_saves(pending, page_id, outputs, summaries)
         return outputs, summaries
 
     # Múltiplas tabelas
@@ -960,7 +1257,7 @@ ARQUIVOS PARA CONFERIR:
                 chart_payload["bbox"] = info.get("bbox")
             if info.get("source"):
                 chart_payload["source"] = info.get("source")
-            (page_out / f"{chart_base}.json").write_text(_json_dumps(chart_payload), encoding="utf-8")
+            write_json_pretty(page_out / f"{chart_base}.json", chart_payload)
             
             if info.get("title"):
                 (page_out / f"{chart_base}-title.txt").write_text(info["title"], encoding="utf-8")
@@ -975,21 +1272,20 @@ ARQUIVOS PARA CONFERIR:
         # NOVO: Detecta se é formato HTML
         if info.get("format") == "html" and info.get("html"):
             logger.info("✅ Tabela %d em formato HTML (estrutura complexa preservada)", table_counter)
-            html = _save_html_table(
-                html_content=info["html"],
-                out_dir=page_out,
-                base_name=base_name,
-                title=info.get("title"),
-                notes=info.get("notes")
-            )
-            
-            # Tenta encontrar Excel gerado (conversão automática em _save_html_table)
-            excel_path = page_out / f"{base_name}.xlsx"
-            if excel_path.exists():
-                outputs.append(excel_path)
-            
-            if html:
-                summaries.append({"page": page_id, "table": base_name, "html": html})
+            # Excel só existe se a conversão automática em _save_html_table funcionar
+            pending.append((
+                _IO_POOL.submit(
+                    _save_html_table,
+                    html_content=info["html"],
+                    out_dir=page_out,
+                    base_name=base_name,
+                    title=info.get("title"),
+                    notes=info.get("notes"),
+                ),
+                base_name,
+                page_out / f"{base_name}.xlsx",
+                True,
+            ))
             
             # Salva JSON individual
             single_payload = {
@@ -1003,7 +1299,7 @@ ARQUIVOS PARA CONFERIR:
                 single_payload["bbox"] = info.get("bbox")
             if info.get("source"):
                 single_payload["source"] = info.get("source")
-            (page_out / f"{base_name}.json").write_text(_json_dumps(single_payload), encoding="utf-8")
+            write_json_pretty(page_out / f"{base_name}.json", single_payload)
             if info.get("title"):
                 (page_out / f"{base_name}-title.txt").write_text(info["title"], encoding="utf-8")
             continue
@@ -1013,10 +1309,12 @@ ARQUIVOS PARA CONFERIR:
         if not rows:
             logger.warning("Tabela %s da página %s vazia após normalização", table_counter, page_id)
             continue
-        html = _save_table_outputs(rows, page_out, base_name, notes=info.get("notes"))
-        outputs.append(page_out / f"{base_name}.xlsx")
-        if html:
-            summaries.append({"page": page_id, "table": base_name, "html": html})
+        pending.append((
+            _IO_POOL.submit(_save_table_outputs, rows, page_out, base_name, notes=info.get("notes")),
+            base_name,
+            page_out / f"{base_name}.xlsx",
+            False,
+        ))
         
         # Salva JSON individual
         single_payload = {
@@ -1032,13 +1330,30 @@ ARQUIVOS PARA CONFERIR:
             single_payload["bbox"] = info.get("bbox")
         if info.get("source"):
             single_payload["source"] = info.get("source")
-        (page_out / f"{base_name}.json").write_text(_json_dumps(single_payload), encoding="utf-8")
+        write_json_pretty(page_out / f"{base_name}.json", single_payload)
         if info.get("title"):
             (page_out / f"{base_name}-title.txt").write_text(info["title"], encoding="utf-8")
     
+    _resolve_pending_saves(pending, page_id, outputs, summaries)
     return outputs, summaries
 
 
+def _resolve_pending_saves(
+    pending: List[Tuple[Future, str, Path, bool]],
+    page_id: str,
+    outputs: List[Path],
+    summaries: List[Dict[str, str]],
+) -> None:
+    """Aguarda as gravações em background e coleta Excel/HTML gerados."""
+    for future, base_name, excel_path, only_if_exists in pending:
+        html = future.result()
+        if not only_if_exists or excel_path.exists():
+            outputs.append(excel_path)
+        if html:
+            summaries.append({"page": page_id, "table": base_name, "html": html})
+    pending.clear()
+
+
 def _format_count_description(content_type: str, count: int) -> str:
     """Formata descrição de quantidade para o prompt"""
     count = max(1, int(count))
@@ -1271,19 +1586,126 @@ def _save_table_outputs(
         return None
 
 
+# Cabeçalho do summary.html (placeholders %s: total, timestamp; '%%' escapa o CSS).
+# O conteúdo é concatenado entre _SUMMARY_HEAD e _SUMMARY_TAIL, sem passar pelo formatador.
+_SUMMARY_HEAD = (
+    "<html><head><meta charset='utf-8'>"
+    "<style>body{font-family:Arial,sans-serif;padding:20px;background:#f9f9f9;color:#333;}"
+    "section.table-block{background:#fff;border:1px solid #ddd;margin-bottom:20px;padding:15px;border-radius:6px;box-shadow:0 1px 3px rgba(0,0,0,0.08);}"
+    "section.table-block h3{margin-top:0;font-size:16px;color:#333;}"
+    "table{border-collapse:collapse;width:100%%;margin-top:10px;}table,th,td{border:1px solid #ccc;}"
+    "th,td{padding:6px;font-size:13px;text-align:left;color:#333;}thead tr{background:#eee;}thead th{color:#333;font-weight:bold;}"
+    "h1{color:#2c3e50;margin-top:0;}"
+    "</style></head><body>"
+    "<h1>Resumo das tabelas/gráficos gerados via LLM</h1>"
+    "<p style='color:#666;font-size:14px;'>Total: %s | Última atualização: %s</p>"
+)
+_SUMMARY_TAIL = "</body></html>"
+
+
+# Fragmentos de cada <section> do summary.html (mesmo formato lido por _SUMMARY_SECTION_RE)
+_SECTION_OPEN = sys.intern("<section class='table-block'><h3>Página ")
+_SECTION_SEP = sys.intern(" - ")
+_SECTION_TITLE_CLOSE = sys.intern("</h3>")
+_SECTION_CLOSE = sys.intern("</section>\n")
+
+_SUMMARY_SECTION_RE = re.compile(
+    r"<section class='table-block'><h3>Página\s+(\S+)\s+-\s+(\S+)</h3>(.*?)</section>",
+    re.DOTALL,
+)
+
+
+def _iter_summary_sections(content: str) -> Iterator[Tuple[str, str, str]]:
+    """Varre o summary.html existente emitindo (page, table, html) seção a seção."""
+    for match in _SUMMARY_SECTION_RE.finditer(content):
+        yield match.group(1), match.group(2), match.group(3)
+
+
+_TABLE_NUM_RE = re.compile(r"(\d+)")
+
+
+def _summary_sort_key(entry: Dict[str, str]) -> Tuple[int, str, str, int]:
+    """Ordena por página e depois por tipo/número do elemento (table-2 antes de table-10)."""
+    return _summary_sort_key_cached(entry.get("page") or "0", entry.get("table") or "")
+
+
+@lru_cache(maxsize=8192)
+def _summary_sort_key_cached(page: str, table: str) -> Tuple[int, str, str, int]:
+    page_num = int(page) if page.isdigit() else 0
+    match = _TABLE_NUM_RE.search(table)
+    if match is None:
+        return page_num, page, table, 0
+    return page_num, page, table[:match.start()], int(match.group(1))
+
+
+def _merge_sorted_entries(
+    existing: Dict[Tuple[str, str], Dict[str, str]],
+    new: Dict[Tuple[str, str], Dict[str, str]],
+) -> Dict[Tuple[str, str], Dict[str, str]]:
+    """
+    Junta as entradas existentes (já na ordem do summary) com as novas sem reordenar tudo:
+    só as novas são ordenadas e intercaladas. Novas sobrescrevem mesma (page, table).
+    """
+    kept = [entry for key, entry in existing.items() if key not in new]
+    keys = [_summary_sort_key(entry) for entry in kept]
+    if any(a > b for a, b in zip(keys, keys[1:])):
+        # summary.html fora de ordem (ex.: editado à mão): ordena uma vez
+        kept.sort(key=_summary_sort_key)
+    added = sorted(new.values(), key=_summary_sort_key)
+    return {
+        (entry["page"], entry["table"]): entry
+        for entry in heapq.merge(kept, added, key=_summary_sort_key)
+    }
+
+
+# Entradas já lidas de cada summary.html, chaveadas por (path, mtime_ns, size)
+_SUMMARY_PARSE_CACHE: Dict[Tuple[str, int, int], Dict[Tuple[str, str], Dict[str, str]]] = {}
+_SUMMARY_PARSE_CACHE_MAX = 16
+
+
+# Hash do conteúdo escrito por último em cada summary.html + stat do arquivo após a escrita
+_LAST_SUMMARY_HASH: Dict[str, Tuple[str, Optional[Tuple[str, int, int]]]] = {}
+
+
+def _summary_cache_key(summary_path: Path) -> Optional[Tuple[str, int, int]]:
+    try:
+        st = summary_path.stat()
+    except FileNotFoundError:
+        return None
+    return str(summary_path), st.st_mtime_ns, st.st_size
+
+
+def _remember_summary_entries(
+    summary_path: Path,
+    entries: Dict[Tuple[str, str], Dict[str, str]],
+) -> None:
+    """Guarda as entradas recém-escritas para o próximo merge no mesmo processo (FIFO limitado)."""
+    path_str = str(summary_path)
+    for key in [k for k in _SUMMARY_PARSE_CACHE if k[0] == path_str]:
+        del _SUMMARY_PARSE_CACHE[key]
+    cache_key = _summary_cache_key(summary_path)
+    if cache_key is None:
+        return
+    _SUMMARY_PARSE_CACHE[cache_key] = entries
+    while len(_SUMMARY_PARSE_CACHE) > _SUMMARY_PARSE_CACHE_MAX:
+        del _SUMMARY_PARSE_CACHE[next(iter(_SUMMARY_PARSE_CACHE))]
+
+
 def _write_summary_html(base_dir: Path, entries: List[Dict[str, str]]) -> None:
     """Escreve summary.html com merge de execuções anteriores"""
     summary_path = base_dir / "summary.html"
     
-    # Carrega entradas existentes
+    # Carrega entradas existentes (reaproveita o parse se o arquivo não mudou)
     existing_entries: Dict[tuple[str, str], Dict[str, str]] = {}
-    if summary_path.exists():
+    cache_key = _summary_cache_key(summary_path)
+    cached_entries = _SUMMARY_PARSE_CACHE.get(cache_key) if cache_key else None
+    if cached_entries is not None:
+        existing_entries = cached_entries
+        logger.info("Reutilizadas %s entradas do summary.html (cache)", len(existing_entries))
+    elif cache_key is not None:
         try:
-            import re
             content = summary_path.read_text(encoding="utf-8")
-            pattern = r"<section class='table-block'><h3>Página\s+(\S+)\s+-\s+(\S+)</h3>(.*?)</section>"
-            matches = re.findall(pattern, content, re.DOTALL)
-            for page, table, html_content in matches:
+            for page, table, html_content in _iter_summary_sections(content):
                 existing_entries[(page, table)] = {
                     "page": page,
                     "table": table,
@@ -1293,125 +1715,137 @@ def _write_summary_html(base_dir: Path, entries: List[Dict[str, str]]) -> None:
         except Exception as e:
             logger.warning("Erro ao ler summary.html existente: %s", e)
     
-    # Merge: novas entradas sobrescrevem existentes
-    all_entries: Dict[tuple[str, str], Dict[str, str]] = existing_entries.copy()
-    for entry in entries:
-        key = (entry["page"], entry["table"])
-        all_entries[key] = entry
+    # Merge: novas entradas sobrescrevem existentes (resultado já em ordem de exibição)
+    new_entries = {(entry["page"], entry["table"]): entry for entry in entries}
+    all_entries = _merge_sorted_entries(existing_entries, new_entries)
     
     logger.info("Total no summary.html: %s (%s novas)", len(all_entries), len(entries))
     
-    # Gera HTML
-    rows = []
-    for entry in sorted(all_entries.values(), key=lambda e: (e["page"], e["table"])):
-        rows.append(
-            f"<section class='table-block'><h3>Página {entry['page']} - {entry['table']}</h3>{entry['html']}</section>"
+    # Gera HTML: lista de fragmentos pré-dimensionada (7 por seção) preenchida por índice
+    # e um único join — join materializaria um gerador numa lista crescente de qualquer forma
+    parts: List[str] = [""] * (len(all_entries) * 7)
+    for i, entry in enumerate(all_entries.values()):
+        j = i * 7
+        parts[j:j + 7] = (
+            _SECTION_OPEN,
+            entry["page"],
+            _SECTION_SEP,
+            entry["table"],
+            _SECTION_TITLE_CLOSE,
+            entry["html"],
+            _SECTION_CLOSE,
         )
+    content = "".join(parts)
     
-    from datetime import datetime
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Sem mudança no conteúdo (timestamp à parte) e arquivo intacto desde a última escrita: não reescreve
+    content_hash = hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+    if _LAST_SUMMARY_HASH.get(str(summary_path)) == (content_hash, cache_key):
+        logger.info("Summary.html inalterado (%s entradas) - escrita ignorada", len(all_entries))
+        return
     
-    template = (
-        "<html><head><meta charset='utf-8'>"
-        "<style>body{{font-family:Arial,sans-serif;padding:20px;background:#f9f9f9;color:#333;}}"
-        "section.table-block{{background:#fff;border:1px solid #ddd;margin-bottom:20px;padding:15px;border-radius:6px;box-shadow:0 1px 3px rgba(0,0,0,0.08);}}"
-        "section.table-block h3{{margin-top:0;font-size:16px;color:#333;}}"
-        "table{{border-collapse:collapse;width:100%;margin-top:10px;}}table,th,td{{border:1px solid #ccc;}}"
-        "th,td{{padding:6px;font-size:13px;text-align:left;color:#333;}}thead tr{{background:#eee;}}thead th{{color:#333;font-weight:bold;}}"
-        "h1{{color:#2c3e50;margin-top:0;}}"
-        "</style></head><body>"
-        "<h1>Resumo das tabelas/gráficos gerados via LLM</h1>"
-        "<p style='color:#666;font-size:14px;'>Total: {total} | Última atualização: {timestamp}</p>"
-        "{content}</body></html>"
-    )
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     
-    html = template.format(
-        total=len(all_entries),
-        timestamp=timestamp,
-        content="\n".join(rows)
-    )
+    html = _SUMMARY_HEAD % (len(all_entries), timestamp) + content + _SUMMARY_TAIL
     
-    summary_path.write_text(html, encoding="utf-8")
+    summary_path.write_bytes(html.encode("utf-8"))
+    _remember_summary_entries(summary_path, all_entries)
+    _LAST_SUMMARY_HASH[str(summary_path)] = (content_hash, _summary_cache_key(summary_path))
     logger.info("Summary.html atualizado: %s entradas", len(all_entries))
 
 
 def _extract_tables_from_payload(payload: dict) -> List[Dict[str, Any]]:
     """Extrai tabelas do payload JSON retornado pelo GPT-5 (suporta HTML e JSON)"""
+    payload_type = payload.get("type")
+    # Tipo não-hashable (lista/dict vindos do modelo) quebraria o .get do dict
+    if not isinstance(payload_type, str):
+        return []
+    handler = _PAYLOAD_TABLE_HANDLERS.get(payload_type)
+    return handler(payload) if handler else []
+
+
+def _tables_from_table_payload(payload: dict) -> List[Dict[str, Any]]:
+    """Payload {type: 'table'} com uma única tabela (HTML ou JSON legado)"""
+    # Formato HTML
+    if payload.get("format") == "html":
+        html = payload.get("html")
+        if not html:
+            return []
+        return [{
+            "format": "html",
+            "html": html,
+            "title": payload.get("title"),
+            "notes": payload.get("notes"),
+        }]
+    # Formato JSON legado
+    table = payload.get("table") or {}
+    rows = table.get("rows") or []
+    if not rows:
+        return []
+    return [{
+        "title": payload.get("title"),
+        "headers": table.get("headers"),
+        "rows": rows,
+        "notes": payload.get("notes"),
+    }]
+
+
+def _tables_from_table_set_payload(payload: dict) -> List[Dict[str, Any]]:
+    """Payload {type: 'table_set'} com várias tabelas/gráficos em 'tables'"""
     tables: List[Dict[str, Any]] = []
-    t = payload.get("type")
-    
-    if t == "table":
+    for entry in payload.get("tables") or []:
+        if not isinstance(entry, dict) or not entry:
+            continue
+        get = entry.get
+        # Entrada de gráfico (conteúdo misto)
+        if get("type") == "chart":
+            chart = get("chart")
+            if chart:
+                tables.append({
+                    "type": "chart",
+                    "chart": chart,
+                    "title": get("title"),
+                    "notes": get("notes"),
+                })
         # Formato HTML
-        if payload.get("format") == "html":
-            html = payload.get("html")
+        elif get("format") == "html":
+            html = get("html")
             if html:
                 tables.append({
                     "format": "html",
                     "html": html,
-                    "title": payload.get("title"),
-                    "notes": payload.get("notes"),
+                    "title": get("title"),
+                    "notes": get("notes"),
                 })
         else:
             # Formato JSON legado
-            table = payload.get("table") or {}
+            table = get("table") or {}
             rows = table.get("rows") or []
-            if rows:
-                tables.append({
-                    "title": payload.get("title"),
-                    "headers": table.get("headers"),
-                    "rows": rows,
-                    "notes": payload.get("notes"),
-                })
-    elif t == "table_set":
-        for entry in payload.get("tables") or []:
-            # Entrada de gráfico (conteúdo misto)
-            if (entry or {}).get("type") == "chart":
-                chart = (entry or {}).get("chart")
-                if chart:
-                    tables.append({
-                        "type": "chart",
-                        "chart": chart,
-                        "title": entry.get("title"),
-                        "notes": entry.get("notes"),
-                    })
-            # Formato HTML
-            elif (entry or {}).get("format") == "html":
-                html = (entry or {}).get("html")
-                if html:
-                    tables.append({
-                        "format": "html",
-                        "html": html,
-                        "title": entry.get("title"),
-                        "notes": entry.get("notes"),
-                    })
-            else:
-                # Formato JSON legado
-                table = (entry or {}).get("table") or {}
-                rows = table.get("rows") or []
-                if not rows:
-                    continue
-                tables.append({
-                    "title": entry.get("title"),
-                    "headers": table.get("headers"),
-                    "rows": rows,
-                    "notes": entry.get("notes"),
-                })
-    
+            if not rows:
+                continue
+            tables.append({
+                "title": get("title"),
+                "headers": table.get("headers"),
+                "rows": rows,
+                "notes": get("notes"),
+            })
     return tables
 
 
+_PAYLOAD_TABLE_HANDLERS = {
+    "table": _tables_from_table_payload,
+    "table_set": _tables_from_table_set_payload,
+}
+
+
 def _normalize_table_rows(headers: Optional[List[Any]], rows: List[List[Any]]) -> List[List[str]]:
-    """Normaliza linhas de tabela para strings"""
+    """Normaliza linhas de tabela para strings (removendo linhas vazias no mesmo passo)"""
     normalized: List[List[str]] = []
-    if headers:
-        normalized.append(["" if h is None else str(h) for h in headers])
-    for row in rows:
-        normalized.append(["" if cell is None else str(cell) for cell in row])
-    # Remove linhas vazias
-    normalized = [r for r in normalized if any(str(cell).strip() for cell in r)]
+    for src in ([headers] if headers else []) + list(rows):
+        # Caso comum (células já são str) não passa por str()
+        row = [
+            cell if type(cell) is str else ("" if cell is None else str(cell))
+            for cell in src
+        ]
+        if any(map(str.strip, row)):
+            normalized.append(row)
     return normalized
-
-
-def _json_dumps(payload: dict) -> str:
-    """Converte dict para JSON formatado"""
-    return json.dumps(payload, ensure_ascii=False, indent=2)
@@ -0,0 +1,59 @@
+"""
+Serialização JSON do pacote: usa orjson quando instalado e cai para o json da stdlib.
+
+`orjson.JSONDecodeError` é subclasse de `json.JSONDecodeError`, então quem chama
+continua tratando erros de parse com `except json.JSONDecodeError`.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - depende de lib opcional
+    orjson = None  # type: ignore
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Parse de JSON a partir de str ou bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(payload: Any) -> str:
+    """JSON compacto, sem escapar caracteres não-ASCII (para logs e cache)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def dumps_pretty(payload: Any) -> str:
+    """Converte dict para JSON formatado (orjson se disponível, senão json da stdlib)"""
+    return _pretty_bytes(payload).decode("utf-8")
+
+
+def write_json_pretty(path: Path, payload: Any) -> None:
+    """Grava o JSON formatado direto em bytes (sem decodificar/recodificar a string)."""
+    path.write_bytes(_pretty_bytes(payload))
+
+
+def _pretty_bytes(payload: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                payload,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        except TypeError:
+            # Tipos que o orjson não serializa: deixa o json da stdlib decidir
+            pass
+    return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
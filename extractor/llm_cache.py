@@ -0,0 +1,172 @@
+"""
+Cache em disco das respostas da LLM, endereçado pelo conteúdo.
+
+A chave é o SHA-256 dos bytes da imagem + prompt + modelo, então reprocessar o
+mesmo PDF (ou repetir uma página durante o desenvolvimento) não chama a API de novo.
+
+Configuração (.env):
+- LLM_CACHE=0 desativa o cache (padrão: ativado)
+- LLM_CACHE_DIR: diretório do banco SQLite (padrão: .llm_cache)
+- LLM_CACHE_TTL_DAYS: validade das entradas em dias (padrão: 30)
+- LLM_CACHE_MAX_MB: tamanho máximo; as entradas menos usadas são removidas (padrão: 512)
+
+As entradas lidas/gravadas na execução atual também ficam numa LRU em memória
+(o JSON serializado, já que quem chama altera o dict retornado), evitando a ida ao
+SQLite quando a mesma página é pedida de novo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from . import json_utils
+from .logging_utils import get_logger
+
+
+logger = get_logger(__name__)
+
+_DEFAULT_DIR = ".llm_cache"
+_DEFAULT_TTL_DAYS = 30.0
+_DEFAULT_MAX_MB = 512.0
+_MEMORY_ENTRIES = 256
+
+_CACHE: Optional["LLMCache"] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def cache_key(image_path: Path, *parts: str) -> str:
+    """SHA-256 dos bytes da imagem seguidos das partes textuais (prompt, modelo...)."""
+    digest = hashlib.sha256(Path(image_path).read_bytes())
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """Tabela SQLite (key, payload, size, created, accessed) com TTL e remoção LRU por tamanho."""
+
+    def __init__(self, directory: Path, ttl_seconds: float, max_bytes: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / "responses.sqlite3"
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, payload BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._memory.get(key)
+            if row is not None and now - row[0] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                blob = row[1]
+            else:
+                self._memory.pop(key, None)
+                try:
+                    row = self._conn.execute(
+                        "SELECT created, payload FROM responses WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error as exc:
+                    # Banco travado por outro processo (PDF_MAX_WORKERS, outra execução): conta como miss
+                    logger.debug("Cache LLM: leitura falhou (%s), seguindo sem cache", exc)
+                    return None
+                if row is None:
+                    return None
+                if now - row[0] > self.ttl_seconds:
+                    self._touch("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                self._touch("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                blob = bytes(row[1])
+                self._remember(key, row[0], blob)
+        try:
+            return json_utils.loads(blob)
+        except (TypeError, ValueError):
+            return None
+
+    def set(self, key: str, payload: dict) -> None:
+        blob = json_utils.dumps(payload).encode("utf-8")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._remember(key, now, blob)
+            self._evict(now)
+
+    def _touch(self, sql: str, params: tuple) -> None:
+        # Manutenção na leitura (LRU/TTL) é opcional: com o banco travado, só pula
+        try:
+            self._conn.execute(sql, params)
+        except sqlite3.Error as exc:
+            logger.debug("Cache LLM: atualização ignorada (%s)", exc)
+
+    def _remember(self, key: str, created: float, blob: bytes) -> None:
+        # LRU em memória; chamado com o lock já adquirido
+        self._memory[key] = (created, blob)
+        self._memory.move_to_end(key)
+        while len(self._memory) > _MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total -= size
+            removed += 1
+        logger.debug("Cache LLM: %d entradas removidas (limite de tamanho)", removed)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.warning("%s inválido (%r); usando %s", name, os.getenv(name), default)
+        return default
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Retorna o cache compartilhado, ou None se desativado (LLM_CACHE=0) ou indisponível."""
+    global _CACHE
+    if os.getenv("LLM_CACHE", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    if _CACHE is not None:
+        return _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            directory = Path(os.getenv("LLM_CACHE_DIR", _DEFAULT_DIR))
+            ttl_days = _env_float("LLM_CACHE_TTL_DAYS", _DEFAULT_TTL_DAYS)
+            max_mb = _env_float("LLM_CACHE_MAX_MB", _DEFAULT_MAX_MB)
+            try:
+                _CACHE = LLMCache(directory, ttl_days * 86400, int(max_mb * 1024 * 1024))
+                logger.info("🗄️  Cache LLM ativo em %s", _CACHE.path)
+            except (OSError, sqlite3.Error) as exc:
+                logger.warning("Cache LLM indisponível (%s); seguindo sem cache.", exc)
+                return None
+    return _CACHE
@@ -1,15 +1,35 @@
 from __future__ import annotations
 
-import base64
+import asyncio
+import binascii
+import hashlib
+import importlib.util
+import io
 import json
+import logging
+import math
+import mmap
 import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import zip_longest
 from pathlib import Path
-from typing import List, Optional, Tuple
+from types import SimpleNamespace
+from urllib.parse import quote
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import httpx
-from openai import OpenAI, AzureOpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, BadRequestError, OpenAI
 from dotenv import load_dotenv
+from PIL import Image
 
+from . import json_utils
+from .llm_cache import LLMCache, cache_key, get_cache
 from .logging_utils import get_logger
 
 
@@ -24,6 +44,9 @@ SYSTEM_MSG = (
     "Para valores incertos, use null. Não invente dados além do que é legível."
 )
 
+# Entra na chave do cache no lugar do texto inteiro (ver _cache_lookup)
+_SYSTEM_MSG_DIGEST = hashlib.sha256(SYSTEM_MSG.encode("utf-8")).hexdigest()
+
 PRECHECK_PROMPT = (
     "Analise esta imagem rapidamente. Retorne JSON: "
     "{'has_content': true/false, 'content_type': 'table'|'chart'|'mixed'|'text_only'|'none', 'count': número}. "
@@ -49,9 +72,223 @@ PRECHECK_PROMPT = (
 )
 
 
+# Número simples ("12", "-3.5") em ticks/valores de eixos de gráficos
+_NUM_RE = re.compile(r"-?\d+(?:\.\d+)?")
+# Abertura de <table> em qualquer caixa; para no primeiro achado, sem copiar o HTML com .lower()
+_TABLE_TAG_RE = re.compile(r"<table", re.IGNORECASE)
+
+# Structured Outputs (json_schema estrito): o servidor garante o formato e o laço de
+# retentativa deixa de disparar por JSON malformado. Modelos que recusam caem para json_object.
+PRECHECK_SCHEMA = {
+    "name": "precheck",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "has_content": {"type": "boolean"},
+            "content_type": {"type": "string", "enum": ["table", "chart", "mixed", "text_only", "none"]},
+            "count": {"type": "integer"},
+        },
+        "required": ["has_content", "content_type", "count"],
+        "additionalProperties": False,
+    },
+}
+# Várias páginas numa só mensagem (ver quick_precheck_grouped)
+PRECHECK_GROUP_SUFFIX = (
+    "\nVocê receberá {count} imagens, cada uma de uma página diferente, na ordem enviada. "
+    "Avalie cada página separadamente e retorne {{'pages': [...]}} com exatamente {count} objetos "
+    "no formato acima, na mesma ordem das imagens."
+)
+PRECHECK_GROUP_SCHEMA = {
+    "name": "precheck_group",
+    "schema": {
+        "type": "object",
+        "properties": {"pages": {"type": "array", "items": PRECHECK_SCHEMA["schema"]}},
+        "required": ["pages"],
+        "additionalProperties": False,
+    },
+}
+_JSON_OBJECT_FORMAT = {"type": "json_object"}
+# Limites do arquivo de entrada da Batch API (200 MB / 50 mil requisições na OpenAI), com folga
+_BATCH_MAX_BYTES = 180 * 1024 * 1024
+_BATCH_MAX_REQUESTS = 50_000
+_NO_SCHEMA_MODELS: set = set()  # (provider, model) que recusaram json_schema
+
+# Classificação do content_type do pre-check (ver _interpret_precheck_payload)
+_EMPTY_CONTENT_TYPES = frozenset({"text_only", "none"})
+_USEFUL_CONTENT_TYPES = frozenset({"table", "chart", "mixed"})
+_NUMBER_TYPES = (int, float)
+
+# Página "em branco" para o pre-check local (ver _is_blank_image)
+_BLANK_THUMB_SIDE = 256
+_BLANK_STDDEV = 4.0
+_BLANK_ENTROPY = 2.0
+
+# Espera antes de repetir após erro de chamada (timeout, 429, 5xx): exponencial com jitter
+_RETRY_BASE_DELAY = 1.0
+_RETRY_MAX_DELAY = 10.0
+
+# Acrescentado ao prompt nas retentativas
+_RETRY_SUFFIX = (
+    "\n\n⚠️ ATENÇÃO: Tentativa {attempt}. A resposta anterior estava incompleta ou inválida. "
+    "Por favor, retorne um JSON COMPLETO e VÁLIDO com TODOS os dados visíveis na imagem."
+)
+
+# Clientes síncronos reaproveitados entre chamadas (ver _get_client)
+_CLIENTS: Dict[Tuple[Optional[str], ...], Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Event loop de fundo, um por processo (ver run_llm_coroutine): as threads das páginas submetem
+# nele as chamadas async, que compartilham os clientes async (pool de conexões, HTTP/2) e o
+# limite de chamadas em voo. _ASYNC_CLIENTS e _ASYNC_INFLIGHT só são usados dentro desse loop.
+_ASYNC_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_ASYNC_LOOP_PID: Optional[int] = None
+_ASYNC_LOOP_LOCK = threading.Lock()
+_ASYNC_CLIENTS: Dict[Tuple[Optional[str], ...], Any] = {}
+_ASYNC_INFLIGHT: Optional[asyncio.Semaphore] = None
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+# Os clientes httpx usam trust_env=False: HTTP(S)_PROXY/ALL_PROXY do ambiente são ignorados
+# (antes eram removidos e restaurados em os.environ a cada cliente, o que não é thread-safe).
+# HTTP/2 multiplexa as requisições simultâneas numa conexão; exige o pacote opcional `h2`
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# A API já reduz imagens "high detail" para caber em 2048x2048; enviar mais que isso só
+# aumenta o upload. Mantido em 2048 (e não menor) por causa das letras pequenas a 900 DPI.
+_MAX_IMAGE_SIDE = 2048
+_JPEG_QUALITY = 85
+_SMALL_IMAGE_BYTES = 512 * 1024
+_B64_CHUNK = 3 * 64 * 1024  # múltiplo de 3: blocos codificam sem padding intermediário
+# Páginas já reduzidas pelo pre-check local, consumidas por _img_to_data_url (~12 MB cada a
+# 2048 px: poucas, uma por worker de pre-check). Chave (caminho, mtime, tamanho) para nunca
+# servir uma imagem regravada; sem LLM em seguida (cache, lote) a entrada só sai por LRU
+_REDUCED_PAGES: "OrderedDict[Tuple[str, int, int], Image.Image]" = OrderedDict()
+_REDUCED_LOCK = threading.Lock()
+_REDUCED_PAGES_MAX = 8
+# Formatos aceitos pela API como estão (extensão → subtipo MIME); o resto é recodificado em JPEG
+_EXT_MIME = {"jpg": "jpeg", "jpeg": "jpeg", "png": "png", "webp": "webp", "gif": "gif"}
+
+
+def _image_url(path: Path) -> str:
+    """
+    URL da imagem para a mensagem. Se LLM_IMAGE_BASE_URL estiver definido e a imagem estiver
+    sob LLM_IMAGE_ROOT (padrão: diretório atual), envia o link HTTP(S) em vez do base64 —
+    o diretório precisa estar publicado nesse endereço (bucket, servidor estático...).
+    Caso contrário, data URL (ver _img_to_data_url).
+    """
+    base_url = os.getenv("LLM_IMAGE_BASE_URL", "").strip()
+    if base_url:
+        root = Path(os.getenv("LLM_IMAGE_ROOT") or Path.cwd()).resolve()
+        try:
+            rel = Path(path).resolve().relative_to(root)
+        except ValueError:
+            logger.debug("Imagem fora de LLM_IMAGE_ROOT (%s), enviando em base64", path)
+        else:
+            return f"{base_url.rstrip('/')}/{quote(rel.as_posix())}"
+    return _img_to_data_url(path)
+
+
 def _img_to_data_url(path: Path) -> str:
-    b64 = base64.b64encode(Path(path).read_bytes()).decode("ascii")
-    return f"data:image/{path.suffix[1:] or 'png'};base64,{b64}"
+    """
+    Codifica a imagem em data URL. Imagens grandes (páginas a 900 DPI) são reduzidas para
+    caber em _MAX_IMAGE_SIDE e recodificadas em JPEG; as pequenas seguem como estão.
+    """
+    path = Path(path)
+    mime = _EXT_MIME.get(path.suffix[1:].lower())
+    # O pre-check local (_is_blank_image) já decodificou e reduziu a página: só codifica
+    reduced = _pop_reduced(path)
+    if reduced is not None:
+        return _jpeg_data_url(reduced)
+    with Image.open(path) as img:
+        if not _send_as_is(path, img, mime):
+            return _jpeg_data_url(_llm_downscale(img))
+
+    with path.open("rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _b64_data_url(mime, mm)
+
+
+def _send_as_is(path: Path, img: Image.Image, mime: Optional[str]) -> bool:
+    """Imagem pequena em formato aceito pela API: vai sem recodificar."""
+    return (
+        mime is not None
+        and max(img.size) <= _MAX_IMAGE_SIDE
+        and path.stat().st_size <= _SMALL_IMAGE_BYTES
+        # GIF animado não é aceito: recodifica o primeiro quadro
+        and not getattr(img, "is_animated", False)
+    )
+
+
+def _llm_downscale(img: Image.Image) -> Image.Image:
+    """Reduz para caber em _MAX_IMAGE_SIDE e só então converte para RGB (não na resolução cheia)."""
+    # JPEG: o libjpeg já decodifica em escala reduzida (1/2, 1/4, 1/8) sem
+    # materializar a resolução cheia; no-op para os demais formatos
+    img.draft("RGB", (_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE))
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        # Paleta/CMYK etc.: o LANCZOS exige modo contínuo
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    img.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.LANCZOS)
+    return _flatten_to_rgb(img)
+
+
+def _jpeg_data_url(rgb: Image.Image) -> str:
+    buf = io.BytesIO()
+    rgb.save(buf, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+    return _b64_data_url("jpeg", buf.getbuffer())
+
+
+def _stash_key(path: Path) -> Tuple[str, int, int]:
+    st = path.stat()
+    return str(path.resolve()), st.st_mtime_ns, st.st_size
+
+
+def _stash_reduced(path: Path, rgb: Image.Image) -> None:
+    key = _stash_key(path)
+    with _REDUCED_LOCK:
+        _REDUCED_PAGES[key] = rgb
+        while len(_REDUCED_PAGES) > _REDUCED_PAGES_MAX:
+            _REDUCED_PAGES.popitem(last=False)
+
+
+def _pop_reduced(path: Path) -> Optional[Image.Image]:
+    if not _REDUCED_PAGES:
+        return None
+    try:
+        key = _stash_key(path)
+    except OSError:
+        return None
+    with _REDUCED_LOCK:
+        return _REDUCED_PAGES.pop(key, None)
+
+
+def _b64_data_url(mime: str, data) -> str:
+    """
+    Monta o data URL codificando `data` (buffer) em blocos direto num bytearray pré-alocado,
+    sem cópias intermediárias de bytes/str do arquivo inteiro.
+    """
+    view = memoryview(data)
+    try:
+        size = view.nbytes
+        prefix = f"data:image/{mime};base64,".encode("ascii")
+        out = bytearray(len(prefix) + 4 * ((size + 2) // 3))
+        out[: len(prefix)] = prefix
+        pos = len(prefix)
+        for start in range(0, size, _B64_CHUNK):
+            encoded = binascii.b2a_base64(view[start : start + _B64_CHUNK], newline=False)
+            out[pos : pos + len(encoded)] = encoded
+            pos += len(encoded)
+        return out.decode("ascii")
+    finally:
+        view.release()
+
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Converte para RGB; transparência vira fundo branco (JPEG não tem canal alfa)."""
+    if img.mode == "RGB":
+        return img.copy()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        bg = Image.new("RGB", rgba.size, "white")
+        bg.paste(rgba, mask=rgba.split()[-1])
+        return bg
+    return img.convert("RGB")
 
 
 def quick_precheck_with_cheap_llm(
@@ -69,6 +306,9 @@ def quick_precheck_with_cheap_llm(
     Retorna: (has_content: bool, content_type: str, count: int)
     count = quantas tabelas/gráficos distintos na página
     """
+    if _is_blank_image(image_path):
+        logger.info("Pre-check: página em branco (%s), sem chamar a LLM", Path(image_path).name)
+        return False, "none", 0
     try:
         payload = call_openai_vision_json(
             image_path,
@@ -80,48 +320,378 @@ def quick_precheck_with_cheap_llm(
             azure_api_version=azure_api_version,
             instructions=PRECHECK_PROMPT,
             max_retries=0,  # Sem retry no pre-check (só verificação rápida)
+            json_schema=PRECHECK_SCHEMA,
         )
 
-        if not payload:
-            logger.debug("Pre-check: payload vazio, assumindo sem conteúdo")
-            return False, "none", 0
+        return _interpret_precheck_payload(payload, cheap_model)
+    except Exception as e:
+        logger.warning("Erro no pre-check com LLM barata: %s. Prosseguindo com GPT-5.", e)
+        return True, "unknown", 1  # Em caso de erro, prossegue (não bloqueia)
 
-        logger.info(
-            "🤖 Pre-check (%s): resposta recebida -> %s",
-            cheap_model,
-            json.dumps(payload, ensure_ascii=False),
-        )
 
-        has_content = payload.get("has_content")
-        content_type = payload.get("content_type", "none")
-        count = payload.get("count", 1)  # Padrão 1 se não especificado
+def quick_precheck_batch(
+    image_paths: Sequence[Path],
+    cheap_model: str,
+    cheap_provider: Optional[str],
+    openrouter_api_key: Optional[str],
+    *,
+    api_key: Optional[str] = None,
+    azure_endpoint: Optional[str] = None,
+    azure_api_version: Optional[str] = None,
+    poll_interval: float = 30.0,
+    timeout: float = 24 * 3600,
+) -> List[Tuple[bool, str, int]]:
+    """
+    Pre-check de várias páginas de uma vez via Batch API (OpenAI/Azure): ~50% do custo,
+    mas sem garantia de tempo (janela de até 24h). Para processamento offline.
+
+    OpenRouter não tem Batch API; nesse caso (ou se o lote falhar/expirar) cai para
+    `quick_precheck_with_cheap_llm` página a página. Resultados na ordem de `image_paths`.
+    """
+    if not image_paths:
+        return []
+    load_dotenv_once()
+
+    def _per_call(paths: Sequence[Path]) -> List[Tuple[bool, str, int]]:
+        return [
+            quick_precheck_with_cheap_llm(
+                path,
+                cheap_model,
+                cheap_provider,
+                openrouter_api_key,
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+            )
+            for path in paths
+        ]
+
+    provider = _resolve_provider(cheap_provider or "openrouter", openrouter_api_key, azure_endpoint)
+    if provider == "openrouter":
+        logger.info("Pre-check em lote indisponível no OpenRouter; usando chamadas individuais")
+        return _per_call(image_paths)
+
+    # Páginas em branco não entram no lote (mesma heurística do pre-check individual)
+    blank = {idx for idx, path in enumerate(image_paths) if _is_blank_image(path)}
+    if blank:
+        logger.info("Pre-check em lote: %d página(s) em branco dispensadas da LLM", len(blank))
+    # Nem as já respondidas antes: mesma chave de cache do pre-check individual
+    extra, _ = _build_prompt("pt-BR", PRECHECK_PROMPT)
+    cached: Dict[int, dict] = {}
+    keys: Dict[int, Optional[str]] = {}
+    cache: Optional[LLMCache] = None
+    pending: List[Tuple[int, Path]] = []
+    for idx, path in enumerate(image_paths):
+        if idx in blank:
+            continue
+        cache, keys[idx], payload = _cache_lookup(path, extra, cheap_model)
+        if payload is not None:
+            cached[idx] = payload
+        else:
+            pending.append((idx, path))
+
+    contents: Dict[str, str] = {}
+    if pending:
+        try:
+            client = _get_client(
+                provider,
+                cheap_model,
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+                openrouter_api_key=openrouter_api_key,
+                sdk=True,
+            )
+            contents = _run_precheck_batch(client, provider, pending, cheap_model, poll_interval, timeout)
+        except Exception as e:
+            logger.warning("Pre-check em lote falhou (%s); usando chamadas individuais", e)
+            return _per_call(image_paths)
+
+    results: List[Tuple[bool, str, int]] = []
+    missing: List[int] = []
+    for idx, path in enumerate(image_paths):
+        if idx in blank:
+            results.append((False, "none", 0))
+            continue
+        if idx in cached:
+            results.append(_interpret_precheck_payload(cached[idx], cheap_model))
+            continue
+        txt = contents.get(str(idx))
+        payload = None
+        if txt:
+            try:
+                payload = json_utils.loads(txt)
+            except ValueError:
+                payload = None
+        if payload is None or not _validate_precheck_payload(payload)[0]:
+            missing.append(idx)
+            results.append((True, "unknown", 1))
+            continue
+        _cache_store(cache, keys[idx], payload)
+        results.append(_interpret_precheck_payload(payload, cheap_model))
+
+    if missing:
+        # Linhas com erro no lote: refaz só essas individualmente
+        logger.warning("Pre-check em lote: %d página(s) sem resposta válida; refazendo individualmente", len(missing))
+        for idx, result in zip(missing, _per_call([image_paths[i] for i in missing])):
+            results[idx] = result
+    return results
+
 
-        logger.info(
-            "Pre-check resumo → has_content=%s | type=%s | count=%s",
-            has_content,
-            content_type,
-            count,
+def _run_precheck_batch(
+    client,
+    provider: str,
+    items: Sequence[Tuple[int, Path]],
+    model: str,
+    poll_interval: float,
+    timeout: float,
+) -> Dict[str, str]:
+    """
+    Envia o JSONL para /v1/batches, aguarda a conclusão e retorna {custom_id: texto da resposta}.
+    `items` são pares (índice, imagem); o índice vira o custom_id.
+
+    Cada página leva o data URL em base64 (~centenas de KB): o JSONL é dividido em vários
+    lotes por tamanho e número de requisições, para não estourar o limite do arquivo de
+    entrada. Um lote que falhe só deixa as suas páginas sem resposta (refeitas pelo chamador).
+    """
+    # Azure usa a rota sem o prefixo /v1 (e `model` é o deployment "GlobalBatch")
+    endpoint = "/chat/completions" if provider == "azure" else "/v1/chat/completions"
+    _, base_prompt = _build_prompt("pt-BR", PRECHECK_PROMPT)
+    is_gpt5 = _is_gpt5(model)
+
+    batches: List[Tuple[Any, int]] = []
+    lines: List[bytes] = []
+    size = 0
+
+    def _submit() -> None:
+        batch_file = client.files.create(file=("precheck.jsonl", b"\n".join(lines)), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=endpoint,
+            completion_window="24h",
         )
+        logger.info("📦 Pre-check em lote enviado: %d páginas, %.0f MB (batch=%s)", len(lines), size / 1e6, batch.id)
+        batches.append((batch, len(lines)))
+
+    for idx, path in items:
+        msg, temp = _build_request(base_prompt, _image_part(_image_url(path)), is_gpt5, 0)
+        line = json_utils.dumps(
+            {
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": endpoint,
+                "body": {
+                    "model": model,
+                    "temperature": temp,
+                    "messages": [msg],
+                    "response_format": {"type": "json_object"},
+                },
+            }
+        ).encode("utf-8")
+        if lines and (size + len(line) + 1 > _BATCH_MAX_BYTES or len(lines) >= _BATCH_MAX_REQUESTS):
+            _submit()
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        _submit()
+    lines = []
+
+    deadline = time.monotonic() + timeout
+    contents: Dict[str, str] = {}
+    for batch, count in batches:
+        try:
+            contents.update(_wait_precheck_batch(client, batch, deadline, poll_interval, timeout))
+        except Exception as e:
+            logger.warning("Pre-check em lote: batch %s falhou (%s); %d página(s) sem resposta", batch.id, e, count)
+    logger.info("📦 Pre-check em lote concluído: %d/%d respostas", len(contents), len(items))
+    return contents
+
+
+def _wait_precheck_batch(client, batch, deadline: float, poll_interval: float, timeout: float) -> Dict[str, str]:
+    """Aguarda um batch terminar e lê {custom_id: texto da resposta} do arquivo de saída."""
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        if time.monotonic() > deadline:
+            client.batches.cancel(batch.id)
+            raise TimeoutError(f"batch {batch.id} não concluiu em {timeout:.0f}s")
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"batch {batch.id} terminou com status={batch.status}")
+
+    contents: Dict[str, str] = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        row = json_utils.loads(line)
+        try:
+            contents[row["custom_id"]] = row["response"]["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            continue
+    return contents
+
+
+def quick_precheck_grouped(
+    image_paths: Sequence[Path],
+    cheap_model: str,
+    cheap_provider: Optional[str],
+    openrouter_api_key: Optional[str],
+    *,
+    api_key: Optional[str] = None,
+    azure_endpoint: Optional[str] = None,
+    azure_api_version: Optional[str] = None,
+) -> List[Tuple[bool, str, int]]:
+    """
+    Pre-check de várias páginas numa única requisição (uma imagem por página na mesma
+    mensagem): o custo fixo da chamada (prompt, latência até o primeiro token) é dividido
+    entre elas. Páginas sem resultado válido na resposta são refeitas individualmente.
+    Resultados na ordem de `image_paths`.
+    """
+    results: List[Optional[Tuple[bool, str, int]]] = [None] * len(image_paths)
+    pending: List[int] = []
+    for idx, path in enumerate(image_paths):
+        if _is_blank_image(path):
+            results[idx] = (False, "none", 0)
+        else:
+            pending.append(idx)
+
+    if len(pending) > 1:
+        try:
+            payloads = _run_precheck_group(
+                [image_paths[idx] for idx in pending],
+                cheap_model,
+                cheap_provider,
+                openrouter_api_key,
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+            )
+        except Exception as e:
+            logger.warning("Pre-check agrupado falhou (%s); usando chamadas individuais", e)
+            payloads = []
+        if len(payloads) == len(pending):
+            for idx, payload in zip(pending, payloads):
+                if isinstance(payload, dict) and _validate_precheck_payload(payload)[0]:
+                    results[idx] = _interpret_precheck_payload(payload, cheap_model)
+        elif payloads:
+            logger.warning(
+                "Pre-check agrupado: %d resultados para %d páginas; refazendo individualmente",
+                len(payloads),
+                len(pending),
+            )
 
-        # Se has_content é False ou content_type é text_only/none, não tem conteúdo útil
-        if has_content is False or content_type in ("text_only", "none"):
-            logger.info("Pre-check LLM barata: SEM conteúdo útil (has_content=%s, type=%s, count=%s)", 
-                       has_content, content_type, count)
-            return False, str(content_type), 0
-        
-        # Se has_content é True ou content_type é table/chart/mixed, tem conteúdo
-        if has_content is True or content_type in ("table", "chart", "mixed"):
-            logger.info("Pre-check LLM barata: TEM conteúdo útil (has_content=%s, type=%s, count=%s)", 
-                       has_content, content_type, count)
-            return True, str(content_type), int(count) if isinstance(count, (int, float)) else 1
-        
-        # Caso ambíguo: prossegue (não bloqueia)
+    for idx, result in enumerate(results):
+        if result is None:
+            results[idx] = quick_precheck_with_cheap_llm(
+                image_paths[idx],
+                cheap_model,
+                cheap_provider,
+                openrouter_api_key,
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+            )
+    return results
+
+
+def _run_precheck_group(
+    paths: Sequence[Path],
+    cheap_model: str,
+    cheap_provider: Optional[str],
+    openrouter_api_key: Optional[str],
+    *,
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+) -> List[Any]:
+    """Uma chamada com todas as imagens de `paths`; retorna a lista `pages` da resposta."""
+    load_dotenv_once()
+    provider = _resolve_provider(cheap_provider or "openrouter", openrouter_api_key, azure_endpoint)
+    client = _get_client(
+        provider,
+        cheap_model,
+        api_key=api_key,
+        azure_endpoint=azure_endpoint,
+        azure_api_version=azure_api_version,
+        openrouter_api_key=openrouter_api_key,
+    )
+    _, base_prompt = _build_prompt("pt-BR", PRECHECK_PROMPT + PRECHECK_GROUP_SUFFIX.format(count=len(paths)))
+    msg, temp = _build_request(base_prompt, _image_part(_image_url(paths[0])), _is_gpt5(cheap_model), 0)
+    msg["content"].extend(_image_part(_image_url(path)) for path in paths[1:])
+    txt = _create_completion(client, provider, cheap_model, temp, msg, PRECHECK_GROUP_SCHEMA)
+    payload = json_utils.loads(txt) if txt else None
+    pages = payload.get("pages") if isinstance(payload, dict) else None
+    return pages if isinstance(pages, list) else []
+
+
+def _is_blank_image(path: Path) -> bool:
+    """
+    Heurística sem API: página praticamente uniforme (capa vazia, folha separadora).
+    Exige desvio padrão E entropia baixos numa miniatura em tons de cinza, para não
+    descartar páginas brancas com pouco conteúdo (uma tabela pequena, uma nota).
+    """
+    path = Path(path)
+    reduced: Optional[Image.Image] = None
+    try:
+        with Image.open(path) as img:
+            if _send_as_is(path, img, _EXT_MIME.get(path.suffix[1:].lower())):
+                thumb = img.convert("L")
+            else:
+                # Página a 900 DPI: reduz primeiro e converte a imagem pequena; a mesma redução
+                # vira o JPEG enviado à LLM se a página não estiver em branco (uma decodificação só)
+                reduced = _llm_downscale(img)
+                thumb = reduced.convert("L")
+        thumb.thumbnail((_BLANK_THUMB_SIDE, _BLANK_THUMB_SIDE))
+        hist = thumb.histogram()
+    except Exception as e:
+        logger.debug("Pre-check: não foi possível analisar %s (%s)", path, e)
+        return False
+    total = sum(hist)
+    if not total:
+        return False
+    mean = sum(i * n for i, n in enumerate(hist)) / total
+    variance = sum(n * (i - mean) ** 2 for i, n in enumerate(hist)) / total
+    blank = variance < _BLANK_STDDEV ** 2 and (
+        -sum((n / total) * math.log2(n / total) for n in hist if n) < _BLANK_ENTROPY
+    )
+    if not blank and reduced is not None and not os.getenv("LLM_IMAGE_BASE_URL", "").strip():
+        # A página vai para a LLM em seguida: _img_to_data_url reaproveita a redução
+        try:
+            _stash_reduced(path, reduced)
+        except OSError:
+            pass
+    return blank
+
+
+def _interpret_precheck_payload(payload: Optional[dict], cheap_model: str) -> Tuple[bool, str, int]:
+    """Converte a resposta do pre-check em (has_content, content_type, count)."""
+    if not payload:
+        logger.debug("Pre-check: payload vazio, assumindo sem conteúdo")
+        return False, "none", 0
+
+    # Serializa a resposta só se o log INFO estiver ativo; o resumo sai na linha de decisão abaixo
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("🤖 Pre-check (%s): resposta recebida -> %s", cheap_model, json_utils.dumps(payload))
+
+    has_content = payload.get("has_content")
+    content_type = str(payload.get("content_type", "none"))  # str: listas/dicts não quebram o `in` abaixo
+    count = payload.get("count", 1)  # Padrão 1 se não especificado
+
+    # Se has_content é False ou content_type é text_only/none, não tem conteúdo útil
+    if has_content is False or content_type in _EMPTY_CONTENT_TYPES:
+        logger.info("Pre-check LLM barata: SEM conteúdo útil (has_content=%s, type=%s, count=%s)", 
+                   has_content, content_type, count)
+        return False, content_type, 0
+
+    # has_content True ou tipo table/chart/mixed: tem conteúdo. Caso ambíguo: prossegue (não bloqueia)
+    if has_content is True or content_type in _USEFUL_CONTENT_TYPES:
+        logger.info("Pre-check LLM barata: TEM conteúdo útil (has_content=%s, type=%s, count=%s)", 
+                   has_content, content_type, count)
+    else:
         logger.warning("Pre-check LLM barata: resposta ambígua (has_content=%s, type=%s, count=%s), prosseguindo", 
                       has_content, content_type, count)
-        return True, str(content_type), int(count) if isinstance(count, (int, float)) else 1
-    except Exception as e:
-        logger.warning("Erro no pre-check com LLM barata: %s. Prosseguindo com GPT-5.", e)
-        return True, "unknown", 1  # Em caso de erro, prossegue (não bloqueia)
+    return True, content_type, int(count) if isinstance(count, _NUMBER_TYPES) else 1
 
 
 def call_openai_vision_json(
@@ -135,6 +705,8 @@ def call_openai_vision_json(
     openrouter_api_key: Optional[str] = None,
     instructions: Optional[str] = None,
     max_retries: int = 2,
+    json_schema: Optional[dict] = None,
+    use_cache: bool = True,
 ) -> Optional[dict]:
     """Chama um modelo de visão com retorno JSON.
 
@@ -142,131 +714,750 @@ def call_openai_vision_json(
     - Se `azure_endpoint` (ou env AZURE_OPENAI_ENDPOINT) estiver definido, usa Azure OpenAI. 
       Em Azure, o `model` deve ser o NOME DO DEPLOYMENT.
     - Se `provider="openrouter"` (ou env OPENROUTER_API_KEY), usa OpenRouter.
+    - `json_schema` ({"name", "schema"}) ativa Structured Outputs estrito; se o modelo não
+      suportar, cai para `json_object` (ver _create_completion).
+    - `use_cache=False` ignora o cache de respostas (ver llm_cache), p.ex. para
+      forçar uma nova amostra do modelo.
     """
     # Ensure .env is loaded if present
-    load_dotenv()
+    load_dotenv_once()
     
-    # Determinar provider
-    if provider is None:
-        # Auto-detectar baseado em variáveis de ambiente ou parâmetros
-        if openrouter_api_key or os.getenv("OPENROUTER_API_KEY"):
-            provider = "openrouter"
-        elif azure_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT"):
-            provider = "azure"
-        else:
-            provider = "openai"
+    extra, base_prompt = _build_prompt(locale, instructions)
+    cache, key, cached = _cache_lookup(image_path, extra, model, use_cache)
+    if cached is not None:
+        return cached
+
+    provider = _resolve_provider(provider, openrouter_api_key, azure_endpoint)
+    client = _get_client(
+        provider,
+        model,
+        api_key=api_key,
+        azure_endpoint=azure_endpoint,
+        azure_api_version=azure_api_version,
+        openrouter_api_key=openrouter_api_key,
+    )
+
+    image_part = _image_part(_image_url(image_path))
+    is_gpt5 = _is_gpt5(model)
     
-    # Limpa temporariamente variáveis de proxy para evitar conflitos com httpx
-    old_proxy = os.environ.pop("HTTP_PROXY", None)
-    old_https_proxy = os.environ.pop("HTTPS_PROXY", None)
-    old_all_proxy = os.environ.pop("ALL_PROXY", None)
+    # Retry logic
+    for attempt in range(max_retries + 1):
+        try:
+            msg, temp = _build_request(base_prompt, image_part, is_gpt5, attempt)
+            txt = _create_completion(client, provider, model, temp, msg, json_schema)
+            done, payload, valid = _parse_llm_response(txt, attempt, max_retries)
+            if done:
+                if valid:
+                    _cache_store(cache, key, payload)
+                return payload
+        except Exception as e:
+            logger.exception("Erro na chamada à LLM na tentativa %s", attempt + 1)
+            if attempt == max_retries:
+                raise
+            time.sleep(_retry_delay(attempt))
     
+    return None
+
+
+
+def call_openai_vision_json_grouped(
+    image_paths: Sequence[Path],
+    model: str = "gpt-5",
+    api_key: Optional[str] = None,
+    locale: str = "pt-BR",
+    azure_endpoint: Optional[str] = None,
+    azure_api_version: Optional[str] = None,
+    provider: Optional[str] = None,
+    openrouter_api_key: Optional[str] = None,
+    instructions: Optional[str] = None,
+    group_suffix: str = "",
+) -> List[Optional[dict]]:
+    """Várias imagens numa única mensagem; `instructions` é a tarefa de uma página e
+    `group_suffix` (com `{count}`) pede `{"pages": [...]}`, um payload por imagem e na mesma ordem.
+
+    Cada payload é validado como numa chamada individual; posições sem payload válido
+    (ou resposta com outra quantidade de páginas) ficam None para o chamador refazer página
+    a página. Sem retentativas: o fallback individual já cobre. Cada página é consultada
+    no cache separadamente, com a mesma chave da chamada individual com `instructions`
+    (independe do tamanho do grupo), e só as que faltam vão na mensagem.
+    """
+    load_dotenv_once()
+
+    extra, _ = _build_prompt(locale, instructions)
+    results: List[Optional[dict]] = []
+    keys: List[Optional[str]] = []
+    cache: Optional[LLMCache] = None
+    for path in image_paths:
+        cache, key, cached = _cache_lookup(path, extra, model)
+        results.append(cached)
+        keys.append(key)
+    missing = [i for i, cached in enumerate(results) if cached is None]
+    if not missing:
+        return results
+    image_paths = [image_paths[i] for i in missing]
+    _, base_prompt = _build_prompt(locale, (instructions or "") + group_suffix.format(count=len(image_paths)))
+
+    provider = _resolve_provider(provider, openrouter_api_key, azure_endpoint)
+    client = _get_client(
+        provider,
+        model,
+        api_key=api_key,
+        azure_endpoint=azure_endpoint,
+        azure_api_version=azure_api_version,
+        openrouter_api_key=openrouter_api_key,
+    )
+    msg, temp = _build_request(base_prompt, _image_part(_image_url(image_paths[0])), _is_gpt5(model), 0)
+    msg["content"].extend(_image_part(_image_url(path)) for path in image_paths[1:])
+    txt = _create_completion(client, provider, model, temp, msg, None)
+    payload = json_utils.loads(txt) if txt else None
+    pages = payload.get("pages") if isinstance(payload, dict) else None
+    if not isinstance(pages, list) or len(pages) != len(image_paths):
+        logger.warning(
+            "Resposta agrupada com %s página(s) para %d imagem(ns)",
+            len(pages) if isinstance(pages, list) else "nenhuma",
+            len(image_paths),
+        )
+        return results
+    for i, page in zip(missing, pages):
+        if isinstance(page, dict) and _validate_payload(page)[0]:
+            results[i] = page
+            _cache_store(cache, keys[i], page)
+    return results
+
+async def call_openai_vision_json_async(
+    image_path: Path,
+    model: str = "gpt-5",
+    api_key: Optional[str] = None,
+    locale: str = "pt-BR",
+    azure_endpoint: Optional[str] = None,
+    azure_api_version: Optional[str] = None,
+    provider: Optional[str] = None,
+    openrouter_api_key: Optional[str] = None,
+    instructions: Optional[str] = None,
+    max_retries: int = 2,
+    client: Optional[Any] = None,
+    json_schema: Optional[dict] = None,
+    use_cache: bool = True,
+) -> Optional[dict]:
+    """Versão assíncrona de `call_openai_vision_json` (AsyncOpenAI/AsyncAzureOpenAI).
+
+    Se `client` não for informado, cria um cliente async só para esta chamada.
+    """
+    load_dotenv_once()
+
+    extra, base_prompt = _build_prompt(locale, instructions)
+    cache, key, cached = await asyncio.to_thread(_cache_lookup, image_path, extra, model, use_cache)
+    if cached is not None:
+        return cached
+
+    provider = _resolve_provider(provider, openrouter_api_key, azure_endpoint)
+    own_client = client is None
+    if own_client:
+        client = _build_client(
+            provider,
+            model,
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            azure_api_version=azure_api_version,
+            openrouter_api_key=openrouter_api_key,
+            asynchronous=True,
+        )
+
+    try:
+        image_part = _image_part(await asyncio.to_thread(_image_url, image_path))
+        is_gpt5 = _is_gpt5(model)
+
+        for attempt in range(max_retries + 1):
+            try:
+                msg, temp = _build_request(base_prompt, image_part, is_gpt5, attempt)
+                txt = await _create_completion_async(client, provider, model, temp, msg, json_schema)
+                done, payload, valid = _parse_llm_response(txt, attempt, max_retries)
+                if done:
+                    if valid:
+                        await asyncio.to_thread(_cache_store, cache, key, payload)
+                    return payload
+            except Exception:
+                logger.exception("Erro na chamada à LLM na tentativa %s", attempt + 1)
+                if attempt == max_retries:
+                    raise
+                await asyncio.sleep(_retry_delay(attempt))
+        return None
+    finally:
+        if own_client:
+            await client.close()
+
+
+async def call_openai_vision_json_batch(
+    requests: Sequence[Tuple[Path, Optional[str]]],
+    model: str = "gpt-5",
+    api_key: Optional[str] = None,
+    locale: str = "pt-BR",
+    azure_endpoint: Optional[str] = None,
+    azure_api_version: Optional[str] = None,
+    provider: Optional[str] = None,
+    openrouter_api_key: Optional[str] = None,
+    max_retries: int = 2,
+    max_concurrency: int = 16,
+    json_schemas: Optional[Sequence[Optional[dict]]] = None,
+) -> List[Optional[dict]]:
+    """Dispara várias chamadas de visão em paralelo com um único cliente async.
+
+    `requests` é uma sequência de pares (image_path, instructions). Até `max_concurrency`
+    chamadas ficam em voo ao mesmo tempo (asyncio.Semaphore). Os resultados voltam na
+    mesma ordem; uma chamada que falhar após os retries resulta em None (erro logado).
+    `json_schemas`, se informado, traz o schema estrito de cada requisição (ou None).
+
+    Rodando no loop de fundo (run_llm_coroutine), o cliente é o compartilhado do processo
+    e vale também o limite global LLM_MAX_INFLIGHT; fora dele, cliente próprio desta chamada.
+    """
+    if not requests:
+        return []
+    load_dotenv_once()
+
+    provider = _resolve_provider(provider, openrouter_api_key, azure_endpoint)
+    shared = asyncio.get_running_loop() is _ASYNC_LOOP
+    if shared:
+        client = _get_async_client(
+            provider,
+            model,
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            azure_api_version=azure_api_version,
+            openrouter_api_key=openrouter_api_key,
+        )
+        inflight = _async_inflight()
+    else:
+        client = _build_client(
+            provider,
+            model,
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            azure_api_version=azure_api_version,
+            openrouter_api_key=openrouter_api_key,
+            asynchronous=True,
+        )
+        inflight = None
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    schemas = list(json_schemas) if json_schemas is not None else [None] * len(requests)
+
+    async def _call(image_path: Path, instructions: Optional[str], json_schema: Optional[dict]) -> Optional[dict]:
+        return await call_openai_vision_json_async(
+            image_path,
+            model=model,
+            locale=locale,
+            provider=provider,
+            instructions=instructions,
+            max_retries=max_retries,
+            client=client,
+            json_schema=json_schema,
+        )
+
+    async def _one(image_path: Path, instructions: Optional[str], json_schema: Optional[dict]) -> Optional[dict]:
+        async with sem:
+            if inflight is None:
+                return await _call(image_path, instructions, json_schema)
+            async with inflight:
+                return await _call(image_path, instructions, json_schema)
+
+    try:
+        results = await asyncio.gather(
+            *(_one(path, instructions, schema) for (path, instructions), schema in zip(requests, schemas)),
+            return_exceptions=True,
+        )
+    finally:
+        if not shared:
+            await client.close()
+
+    payloads: List[Optional[dict]] = []
+    for (path, _), result in zip(requests, results):
+        if isinstance(result, BaseException):
+            logger.error("Chamada à LLM falhou para %s: %s", path, result)
+            payloads.append(None)
+        else:
+            payloads.append(result)
+    return payloads
+
+
+def run_llm_coroutine(coro):
+    """
+    Executa `coro` no event loop de fundo do processo e devolve o resultado (bloqueia a
+    thread chamadora). Substitui um asyncio.run por página: clientes async e conexões
+    passam a ser reaproveitados entre páginas, com um limite único de chamadas em voo.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _ASYNC_LOOP, _ASYNC_LOOP_PID, _ASYNC_INFLIGHT
+    pid = os.getpid()
+    if _ASYNC_LOOP is not None and _ASYNC_LOOP_PID == pid:
+        return _ASYNC_LOOP
+    with _ASYNC_LOOP_LOCK:
+        # Processo filho (fork) herda a referência, mas não a thread que roda o loop: recria
+        if _ASYNC_LOOP is None or _ASYNC_LOOP_PID != pid:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="extractor-llm-loop", daemon=True).start()
+            _ASYNC_CLIENTS.clear()
+            _ASYNC_INFLIGHT = None
+            _ASYNC_LOOP, _ASYNC_LOOP_PID = loop, pid
+    return _ASYNC_LOOP
+
+
+def _get_async_client(
+    provider: str,
+    model: str,
+    *,
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+    openrouter_api_key: Optional[str],
+):
+    """Cliente async compartilhado, um por provedor/credenciais; só chamado dentro do loop de fundo."""
+    key = (provider, api_key, azure_endpoint, azure_api_version, openrouter_api_key)
+    client = _ASYNC_CLIENTS.get(key)
+    if client is None:
+        client = _ASYNC_CLIENTS[key] = _build_client(
+            provider,
+            model,
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            azure_api_version=azure_api_version,
+            openrouter_api_key=openrouter_api_key,
+            asynchronous=True,
+        )
+    return client
+
+
+def _async_inflight() -> asyncio.Semaphore:
+    """Limite de chamadas em voo no processo todo (LLM_MAX_INFLIGHT, padrão 16)."""
+    global _ASYNC_INFLIGHT
+    if _ASYNC_INFLIGHT is None:
+        try:
+            limit = max(1, int(os.getenv("LLM_MAX_INFLIGHT", "16")))
+        except ValueError:
+            limit = 16
+        _ASYNC_INFLIGHT = asyncio.Semaphore(limit)
+    return _ASYNC_INFLIGHT
+
+
+def _response_format(provider: str, model: str, json_schema: Optional[dict]) -> dict:
+    if json_schema is None or (provider, model) in _NO_SCHEMA_MODELS:
+        return _JSON_OBJECT_FORMAT
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": json_schema["name"], "strict": True, "schema": json_schema["schema"]},
+    }
+
+
+def _schema_rejected(provider: str, model: str, exc: Exception) -> bool:
+    """
+    Se o 400 é recusa do json_schema, registra (as próximas chamadas vão direto de json_object)
+    e retorna True. Outros 400 (filtro de conteúdo, contexto excedido...) retornam False:
+    repetir com json_object só faria uma segunda chamada igualmente rejeitada.
+    """
+    message = str(exc).lower()
+    if "schema" not in message and "response_format" not in message:
+        return False
+    _NO_SCHEMA_MODELS.add((provider, model))
+    logger.warning(
+        "Modelo %s (%s) recusou response_format json_schema (%s); usando json_object",
+        model,
+        provider,
+        exc,
+    )
+    return True
+
+
+def _stream_enabled(client) -> bool:
+    # Streaming é opt-in: no GPT-5 da OpenAI exige organização verificada
+    if isinstance(client, _RawChatClient):
+        return False
+    return os.getenv("LLM_STREAM", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _message_text(resp) -> Optional[str]:
+    return resp.choices[0].message.content if resp.choices else None
+
+
+def _stream_text(stream) -> Optional[str]:
+    """Acumula os deltas do stream (chunks sem choices, ex. filtro de conteúdo do Azure, são ignorados)."""
+    parts = [chunk.choices[0].delta.content for chunk in stream if chunk.choices]
+    return "".join(p for p in parts if p) or None
+
+
+async def _stream_text_async(stream) -> Optional[str]:
+    parts = [chunk.choices[0].delta.content async for chunk in stream if chunk.choices]
+    return "".join(p for p in parts if p) or None
+
+
+def _create_completion(
+    client,
+    provider: str,
+    model: str,
+    temp: float,
+    msg: dict,
+    json_schema: Optional[dict],
+) -> Optional[str]:
+    """
+    Executa o chat completion e retorna o texto da resposta.
+    Com LLM_STREAM=1 a resposta chega em streaming: o timeout passa a valer entre chunks,
+    e não para a resposta inteira (tabelas longas podem levar minutos para terminar).
+    """
+    response_format = _response_format(provider, model, json_schema)
+    stream = _stream_enabled(client)
+    extra = {"stream": True} if stream else {}
+    read = _stream_text if stream else _message_text
+    try:
+        return read(
+            client.chat.completions.create(
+                model=model,
+                temperature=temp,
+                messages=[msg],
+                response_format=response_format,
+                **extra,
+            )
+        )
+    except BadRequestError as e:
+        if response_format is _JSON_OBJECT_FORMAT or not _schema_rejected(provider, model, e):
+            raise
+    return read(
+        client.chat.completions.create(
+            model=model,
+            temperature=temp,
+            messages=[msg],
+            response_format=_JSON_OBJECT_FORMAT,
+            **extra,
+        )
+    )
+
+
+async def _create_completion_async(
+    client,
+    provider: str,
+    model: str,
+    temp: float,
+    msg: dict,
+    json_schema: Optional[dict],
+) -> Optional[str]:
+    response_format = _response_format(provider, model, json_schema)
+    stream = _stream_enabled(client)
+    extra = {"stream": True} if stream else {}
+
+    async def _read(resp) -> Optional[str]:
+        return await _stream_text_async(resp) if stream else _message_text(resp)
+
     try:
-        if provider == "openrouter":
-            openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
-            if not openrouter_api_key:
-                raise RuntimeError("Defina OPENROUTER_API_KEY para usar OpenRouter.")
-            logger.info("Chamando OpenRouter modelo=%s", model)
-            http_client = httpx.Client(timeout=180.0)  # 3 minutos para imagens grandes
-            client = OpenAI(
-                api_key=openrouter_api_key,
-                base_url="https://openrouter.ai/api/v1",
-                http_client=http_client,
+        return await _read(
+            await client.chat.completions.create(
+                model=model,
+                temperature=temp,
+                messages=[msg],
+                response_format=response_format,
+                **extra,
             )
-        elif provider == "azure":
-            azure_endpoint = azure_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
-            api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
-            if not api_key:
-                raise RuntimeError("Defina AZURE_OPENAI_API_KEY para usar Azure OpenAI.")
-            if not azure_endpoint:
-                raise RuntimeError("Defina AZURE_OPENAI_ENDPOINT para usar Azure OpenAI.")
-            azure_api_version = azure_api_version or os.getenv("AZURE_OPENAI_API_VERSION", "2025-03-01-preview")
-            logger.info("Chamando Azure OpenAI deployment=%s endpoint=%s", model, azure_endpoint)
-            http_client = httpx.Client(timeout=180.0)  # 3 minutos para imagens grandes
-            client = AzureOpenAI(
+        )
+    except BadRequestError as e:
+        if response_format is _JSON_OBJECT_FORMAT or not _schema_rejected(provider, model, e):
+            raise
+    return await _read(
+        await client.chat.completions.create(
+            model=model,
+            temperature=temp,
+            messages=[msg],
+            response_format=_JSON_OBJECT_FORMAT,
+            **extra,
+        )
+    )
+
+
+def _cache_lookup(
+    image_path: Path,
+    extra: str,
+    model: str,
+    use_cache: bool = True,
+) -> Tuple[Optional[LLMCache], Optional[str], Optional[dict]]:
+    """Consulta o cache pela chave SHA-256(imagem + prompt + modelo). Retorna (cache, chave, payload)."""
+    cache = get_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = cache_key(image_path, _SYSTEM_MSG_DIGEST, extra, model)
+    try:
+        cached = cache.get(key)
+    except sqlite3.Error as e:
+        # Falha do cache nunca derruba a chamada: segue como miss
+        logger.warning("Falha ao ler o cache LLM: %s", e)
+        cached = None
+    if cached is not None:
+        logger.info("🗄️  Resposta da LLM reaproveitada do cache (%s, %s)", Path(image_path).name, model)
+    return cache, key, cached
+
+
+def _cache_store(cache: Optional[LLMCache], key: Optional[str], payload: Optional[dict]) -> None:
+    # Chamado só com respostas já validadas em _parse_llm_response
+    if cache is None or key is None or payload is None:
+        return
+    try:
+        cache.set(key, payload)
+    except Exception as e:
+        logger.warning("Falha ao gravar no cache LLM: %s", e)
+
+
+@lru_cache(maxsize=1)
+def load_dotenv_once() -> None:
+    """Lê o .env uma vez por processo (antes o arquivo era relido a cada chamada à LLM e no runner)."""
+    load_dotenv()
+
+
+def _resolve_provider(
+    provider: Optional[str],
+    openrouter_api_key: Optional[str],
+    azure_endpoint: Optional[str],
+) -> str:
+    if provider is not None:
+        return provider
+    # Auto-detectar baseado em variáveis de ambiente ou parâmetros
+    if openrouter_api_key or os.getenv("OPENROUTER_API_KEY"):
+        return "openrouter"
+    if azure_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT"):
+        return "azure"
+    return "openai"
+
+
+def _get_client(
+    provider: str,
+    model: str,
+    *,
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+    openrouter_api_key: Optional[str],
+    sdk: bool = False,
+):
+    """
+    Cliente síncrono compartilhado pelo processo, um por provedor/credenciais.
+    Reaproveita o pool de conexões (TCP/TLS) entre páginas em vez de abrir um por chamada.
+    Clientes async não entram aqui: ficam presos ao event loop que os criou.
+
+    Com EXTRACTOR_RAW_AZURE=1, Azure e OpenRouter usam _RawChatClient (POST direto via httpx);
+    `sdk=True` força o cliente do SDK (necessário para files/batches).
+    """
+    raw = not sdk and provider in ("azure", "openrouter") and _raw_http_enabled()
+    key = (provider, api_key, azure_endpoint, azure_api_version, openrouter_api_key, raw)
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            build = _build_raw_client if raw else _build_client
+            client = build(
+                provider,
+                model,
                 api_key=api_key,
                 azure_endpoint=azure_endpoint,
-                api_version=azure_api_version,
-                http_client=http_client,
+                azure_api_version=azure_api_version,
+                openrouter_api_key=openrouter_api_key,
             )
-        else:  # provider == "openai" ou padrão
-            api_key = api_key or os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise RuntimeError("Defina OPENAI_API_KEY, AZURE_OPENAI_API_KEY ou OPENROUTER_API_KEY para usar o fallback LLM.")
-            logger.info("Chamando OpenAI público modelo=%s", model)
-            http_client = httpx.Client(timeout=180.0)  # 3 minutos para imagens grandes
-            client = OpenAI(api_key=api_key, http_client=http_client)
-    finally:
-        # Restaura variáveis de ambiente
-        if old_proxy:
-            os.environ["HTTP_PROXY"] = old_proxy
-        if old_https_proxy:
-            os.environ["HTTPS_PROXY"] = old_https_proxy
-        if old_all_proxy:
-            os.environ["ALL_PROXY"] = old_all_proxy
+            _CLIENTS[key] = client
+    return client
+
+
+def _raw_http_enabled() -> bool:
+    return os.getenv("EXTRACTOR_RAW_AZURE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+class _RawChatClient:
+    """
+    Cliente mínimo para chat completions via POST direto (httpx), sem o SDK.
+    Expõe só o que este módulo usa: `client.chat.completions.create(...)` retornando
+    um objeto com `.choices[0].message.content`. HTTP 400 vira `BadRequestError`,
+    como no SDK, para o fallback de json_schema continuar funcionando.
+    """
+
+    def __init__(self, http_client: httpx.Client, url_template: str, headers: Dict[str, str]) -> None:
+        self._http = http_client
+        self._url_template = url_template
+        self._headers = {**headers, "Content-Type": "application/json"}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **body: Any):
+        url = self._url_template.format(model=body["model"])
+        resp = self._http.post(url, headers=self._headers, content=json_utils.dumps(body).encode("utf-8"))
+        if resp.status_code == 400:
+            raise BadRequestError(resp.text, response=resp, body=None)
+        resp.raise_for_status()
+        data = json_utils.loads(resp.content)
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(message=SimpleNamespace(content=(choice.get("message") or {}).get("content")))
+                for choice in data.get("choices") or []
+            ]
+        )
+
+    def close(self) -> None:
+        self._http.close()
+
+
+def _http_client(http_cls):
+    """httpx.Client/AsyncClient com o pool compartilhado, sem proxies do ambiente e HTTP/2 se houver `h2`."""
+    return http_cls(timeout=180.0, limits=_HTTP_LIMITS, trust_env=False, http2=_HTTP2)  # 3 minutos para imagens grandes
 
+
+def _build_raw_client(
+    provider: str,
+    model: str,
+    *,
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+    openrouter_api_key: Optional[str],
+) -> _RawChatClient:
+    http_client = _http_client(httpx.Client)
+    if provider == "openrouter":
+        openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+        if not openrouter_api_key:
+            raise RuntimeError("Defina OPENROUTER_API_KEY para usar OpenRouter.")
+        logger.info("Chamando OpenRouter (HTTP direto) modelo=%s", model)
+        return _RawChatClient(
+            http_client,
+            "https://openrouter.ai/api/v1/chat/completions",
+            {"Authorization": f"Bearer {openrouter_api_key}"},
+        )
+    azure_endpoint = azure_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Defina AZURE_OPENAI_API_KEY para usar Azure OpenAI.")
+    if not azure_endpoint:
+        raise RuntimeError("Defina AZURE_OPENAI_ENDPOINT para usar Azure OpenAI.")
+    azure_api_version = azure_api_version or os.getenv("AZURE_OPENAI_API_VERSION", "2025-03-01-preview")
+    logger.info("Chamando Azure OpenAI (HTTP direto) deployment=%s endpoint=%s", model, azure_endpoint)
+    return _RawChatClient(
+        http_client,
+        f"{azure_endpoint.rstrip('/')}/openai/deployments/{{model}}/chat/completions?api-version={azure_api_version}",
+        {"api-key": api_key},
+    )
+
+
+def _build_client(
+    provider: str,
+    model: str,
+    *,
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+    openrouter_api_key: Optional[str],
+    asynchronous: bool = False,
+):
+    """Cria o cliente do provedor (síncrono ou assíncrono) com as mesmas regras de credenciais."""
+    openai_cls = AsyncOpenAI if asynchronous else OpenAI
+    azure_cls = AsyncAzureOpenAI if asynchronous else AzureOpenAI
+    http_cls = httpx.AsyncClient if asynchronous else httpx.Client
+
+    if provider == "openrouter":
+        openrouter_api_key = openrouter_api_key or os.getenv("OPENROUTER_API_KEY")
+        if not openrouter_api_key:
+            raise RuntimeError("Defina OPENROUTER_API_KEY para usar OpenRouter.")
+        logger.info("Chamando OpenRouter modelo=%s", model)
+        http_client = _http_client(http_cls)
+        return openai_cls(
+            api_key=openrouter_api_key,
+            base_url="https://openrouter.ai/api/v1",
+            http_client=http_client,
+        )
+    if provider == "azure":
+        azure_endpoint = azure_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("Defina AZURE_OPENAI_API_KEY para usar Azure OpenAI.")
+        if not azure_endpoint:
+            raise RuntimeError("Defina AZURE_OPENAI_ENDPOINT para usar Azure OpenAI.")
+        azure_api_version = azure_api_version or os.getenv("AZURE_OPENAI_API_VERSION", "2025-03-01-preview")
+        logger.info("Chamando Azure OpenAI deployment=%s endpoint=%s", model, azure_endpoint)
+        http_client = _http_client(http_cls)
+        return azure_cls(
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            api_version=azure_api_version,
+            http_client=http_client,
+        )
+    # provider == "openai" ou padrão
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Defina OPENAI_API_KEY, AZURE_OPENAI_API_KEY ou OPENROUTER_API_KEY para usar o fallback LLM.")
+    logger.info("Chamando OpenAI público modelo=%s", model)
+    http_client = _http_client(http_cls)
+    return openai_cls(api_key=api_key, http_client=http_client)
+
+
+@lru_cache(maxsize=256)
+def _build_prompt(locale: str, instructions: Optional[str]) -> Tuple[str, str]:
+    """Retorna (sufixo da tarefa, prompt completo = SYSTEM_MSG + sufixo)."""
+    # Os prompts são poucos e repetidos (pre-check, extração, segmentos): strip/concat uma vez só
     extra = f"\nIdioma dos rótulos de saída: {locale}. \nFormato: JSON puro, sem markdown."
     if instructions:
         extra += f"\nTarefa: {instructions.strip()}"
+    return extra, SYSTEM_MSG + extra
+
+
+def _build_request(base_prompt: str, image_part: dict, is_gpt5: bool, attempt: int) -> Tuple[dict, float]:
+    """
+    Monta a mensagem (texto + imagem) e a temperatura para a tentativa `attempt`.
+    `base_prompt` e `image_part` (com o data URL de vários MB) são montados uma vez por chamada.
+    """
+    # Se for uma retry, adiciona feedback sobre o erro
+    prompt = base_prompt if attempt == 0 else base_prompt + _RETRY_SUFFIX.format(attempt=attempt + 1)
+    msg = {
+        "role": "user",
+        "content": [{"type": "text", "text": prompt}, image_part],
+    }
     
-    data_url = _img_to_data_url(image_path)
+    # GPT-5 só aceita temperature=1 (padrão)
+    temp = 1 if is_gpt5 else (0.2 if attempt == 0 else 0.3)
+    return msg, temp
+
+
+def _is_gpt5(model: str) -> bool:
+    return "gpt-5" in model.lower()
+
+
+def _image_part(data_url: str) -> dict:
+    return {"type": "image_url", "image_url": {"url": data_url}}
+
+
+def _retry_delay(attempt: int) -> float:
+    """Backoff exponencial (1s, 2s, 4s... até _RETRY_MAX_DELAY) com jitter, para não sincronizar as threads."""
+    return random.uniform(0.5, 1.0) * min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** attempt)
+
+
+def _parse_llm_response(
+    txt: Optional[str],
+    attempt: int,
+    max_retries: int,
+) -> Tuple[bool, Optional[dict], bool]:
+    """
+    Interpreta o texto retornado pela LLM.
+    Retorna (encerrar, payload, válido): encerrar=False indica que vale tentar novamente;
+    `válido` evita revalidar o payload depois (p.ex. para gravar no cache).
+    """
+    if not txt:
+        logger.warning("Resposta vazia da LLM na tentativa %s", attempt + 1)
+        return False, None, False
     
-    # Retry logic
-    for attempt in range(max_retries + 1):
-        try:
-            prompt = SYSTEM_MSG + extra
-            
-            # Se for uma retry, adiciona feedback sobre o erro
-            if attempt > 0:
-                prompt += f"\n\n⚠️ ATENÇÃO: Tentativa {attempt + 1}. A resposta anterior estava incompleta ou inválida. Por favor, retorne um JSON COMPLETO e VÁLIDO com TODOS os dados visíveis na imagem."
-            
-            msg = {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": data_url}},
-                ],
-            }
-            
-            # GPT-5 só aceita temperature=1 (padrão)
-            temp = 1 if "gpt-5" in model.lower() else (0.2 if attempt == 0 else 0.3)
-            
-            resp = client.chat.completions.create(
-                model=model,
-                temperature=temp,
-                messages=[msg],
-                response_format={"type": "json_object"},
-            )
-            
-            txt = resp.choices[0].message.content
-            if not txt:
-                logger.warning("Resposta vazia da LLM na tentativa %s", attempt + 1)
-                continue
-            
-            try:
-                payload = json.loads(txt)
-                
-                # Valida o payload
-                valid, msg_error = _validate_payload(payload)
-                if valid:
-                    logger.info("JSON válido obtido na tentativa %s", attempt + 1)
-                    return payload
-                else:
-                    logger.warning("Validação falhou na tentativa %s: %s", attempt + 1, msg_error)
-                    if attempt == max_retries:
-                        # Última tentativa, retorna mesmo inválido para logging
-                        return payload
-            except json.JSONDecodeError as e:
-                logger.warning("Erro ao parsear JSON na tentativa %s: %s", attempt + 1, e)
-                if attempt == max_retries:
-                    return None
-        
-        except Exception as e:
-            logger.exception("Erro na chamada à LLM na tentativa %s", attempt + 1)
-            if attempt == max_retries:
-                raise
+    try:
+        payload = json_utils.loads(txt)
+    except json.JSONDecodeError as e:
+        logger.warning("Erro ao parsear JSON na tentativa %s: %s", attempt + 1, e)
+        return attempt == max_retries, None, False
     
-    return None
+    # Valida o payload
+    valid, msg_error = _validate_payload(payload)
+    if valid:
+        logger.info("JSON válido obtido na tentativa %s", attempt + 1)
+        return True, payload, True
+    logger.warning("Validação falhou na tentativa %s: %s", attempt + 1, msg_error)
+    # Última tentativa, retorna mesmo inválido para logging
+    return attempt == max_retries, payload if attempt == max_retries else None, False
 
 
 def _validate_precheck_payload(payload: dict) -> Tuple[bool, str]:
@@ -281,10 +1472,128 @@ def _validate_precheck_payload(payload: dict) -> Tuple[bool, str]:
     return False, "Formato de pre-check inválido"
 
 
+def _validate_html_entry(entry: dict) -> Optional[str]:
+    """Formato HTML: {format:'html', html:'<table>...'}. Retorna a mensagem de erro ou None."""
+    html = entry.get("html")
+    if not html or not isinstance(html, str) or len(html.strip()) < 10:
+        return "Campo 'html' ausente ou inválido"
+    if not _TABLE_TAG_RE.search(html):
+        return "HTML não contém <table>"
+    return None
+
+
+def _validate_table(payload: dict) -> Tuple[bool, str]:
+    # NOVO: Aceita formato HTML ou formato JSON legado
+    if payload.get("format") == "html":
+        error = _validate_html_entry(payload)
+        return (False, error) if error else (True, "OK")
+    # Formato JSON legado: valida campo 'table' com 'rows'
+    table = payload.get("table")
+    if not table:
+        return False, "Campo 'table' ausente"
+    rows = table.get("rows") if isinstance(table, dict) else None
+    if not rows or not isinstance(rows, list):
+        return False, "Campo 'rows' vazio ou inválido"
+    # Verifica se as linhas têm conteúdo
+    if not any(any(str(cell).strip() for cell in row) for row in rows):
+        return False, "Todas as linhas estão vazias"
+    return True, "OK"
+
+
+def _validate_table_set(payload: dict) -> Tuple[bool, str]:
+    tables = payload.get("tables")
+    if not tables or not isinstance(tables, list):
+        return False, "Campo 'tables' ausente ou inválido"
+    for idx, entry in enumerate(tables, start=1):
+        if not isinstance(entry, dict):
+            return False, f"Entrada {idx} sem campo 'table' ou 'html'"
+        # NOVO: Aceita formato HTML ou formato JSON legado
+        if entry.get("format") == "html":
+            error = _validate_html_entry(entry)
+            if error:
+                return False, f"Entrada {idx}: {error}"
+            continue
+        # Formato JSON legado: valida campo 'table' com 'rows'
+        table = entry.get("table")
+        if not table:
+            return False, f"Entrada {idx} sem campo 'table' ou 'html'"
+        rows = table.get("rows") if isinstance(table, dict) else None
+        if not rows or not isinstance(rows, list):
+            return False, f"Tabela {idx} sem 'rows'"
+    return True, "OK"
+
+
+def _validate_ternary(ternary: Any) -> Tuple[bool, str]:
+    """Valida estrutura ternária (triângulo de textura, etc)."""
+    if not isinstance(ternary, dict):
+        return False, "Campo 'ternary' com formato inválido"
+    # Formato 1: ternary.axes + ternary.regions
+    if ternary.get("axes") or ternary.get("regions"):
+        return True, "OK"
+    # Formato 2: ternary.a/b/c + chart.series ou chart.regions
+    # Formato 3: só os eixos a/b/c (sem series)
+    if ternary.get("a") or ternary.get("b") or ternary.get("c"):
+        return True, "OK"
+    return False, "Gráfico ternário sem estrutura reconhecida"
+
+
+def _validate_chart(payload: dict) -> Tuple[bool, str]:
+    chart = payload.get("chart")
+    if not chart or not isinstance(chart, dict):
+        return False, "Campo 'chart' ausente"
+
+    ternary = chart.get("ternary")
+    if ternary:
+        return _validate_ternary(ternary)
+
+    # Valida estrutura x/series
+    x = chart.get("x")
+    if x:
+        x_vals = x.get("values") if isinstance(x, dict) else None
+        series = chart.get("series")
+        if not x_vals or not series:
+            return False, "Gráfico com x ou series vazios"
+        if not isinstance(series, list):
+            return False, "Series inválido ou vazio"
+        # Verifica se pelo menos uma série tem valores
+        if not any(isinstance(s, dict) and s.get("values") for s in series):
+            return False, "Nenhuma série contém valores"
+        return True, "OK"
+
+    # Valida estrutura labels/series alternativa
+    labels = chart.get("labels")
+    series_as_rows = chart.get("series")
+    if labels and series_as_rows:
+        if not isinstance(labels, list) or not isinstance(series_as_rows, list):
+            return False, "Labels ou series com formato inválido"
+        return True, "OK"
+
+    return False, "Estrutura de gráfico não reconhecida"
+
+
+def _validate_text(payload: dict) -> Tuple[bool, str]:
+    """Páginas text-only (ver text_extraction.TEXT_EXTRACTION_PROMPT)."""
+    sections = payload.get("sections")
+    if not sections or not isinstance(sections, list):
+        return False, "Campo 'sections' ausente ou vazio"
+    return True, "OK"
+
+
+# Um validador por tipo de payload: despacho direto em vez de cadeia de if/elif
+_PAYLOAD_VALIDATORS = {
+    "table": _validate_table,
+    "table_set": _validate_table_set,
+    "chart": _validate_chart,
+    "text": _validate_text,
+}
+
+
 def _validate_payload(payload: dict) -> Tuple[bool, str]:
     """Valida se o payload JSON está completo e bem formado (extração de tabelas/gráficos)."""
     if not payload:
         return False, "Payload vazio"
+    if not isinstance(payload, dict):
+        return False, "Payload não é um objeto JSON"
     
     # Se é pre-check, usa validação específica
     if "has_content" in payload or "content_type" in payload:
@@ -294,110 +1603,13 @@ def _validate_payload(payload: dict) -> Tuple[bool, str]:
     if not t:
         return False, "Campo 'type' ausente"
     
-    if t == "table":
-        # NOVO: Aceita formato HTML ou formato JSON legado
-        if payload.get("format") == "html":
-            # Formato HTML: valida campo 'html'
-            html = payload.get("html")
-            if not html or not isinstance(html, str) or len(html.strip()) < 10:
-                return False, "Campo 'html' ausente ou inválido"
-            if "<table" not in html.lower():
-                return False, "HTML não contém <table>"
-            return True, "OK"
-        else:
-            # Formato JSON legado: valida campo 'table' com 'rows'
-            table = payload.get("table", {})
-            if not table:
-                return False, "Campo 'table' ausente"
-            rows = table.get("rows")
-            if not rows or not isinstance(rows, list) or len(rows) == 0:
-                return False, "Campo 'rows' vazio ou inválido"
-            # Verifica se as linhas têm conteúdo
-            if not any(any(str(cell).strip() for cell in row) for row in rows):
-                return False, "Todas as linhas estão vazias"
-            return True, "OK"
-    
-    elif t == "table_set":
-        tables = payload.get("tables")
-        if not tables or not isinstance(tables, list):
-            return False, "Campo 'tables' ausente ou inválido"
-        for idx, entry in enumerate(tables, start=1):
-            # NOVO: Aceita formato HTML ou formato JSON legado
-            if (entry or {}).get("format") == "html":
-                # Formato HTML: valida campo 'html'
-                html = (entry or {}).get("html")
-                if not html or not isinstance(html, str) or len(html.strip()) < 10:
-                    return False, f"Entrada {idx} com 'format': 'html' mas sem 'html' válido"
-                # HTML válido se contém <table>
-                if "<table" not in html.lower():
-                    return False, f"Entrada {idx}: HTML não contém <table>"
-            else:
-                # Formato JSON legado: valida campo 'table' com 'rows'
-                table = (entry or {}).get("table")
-                if not table:
-                    return False, f"Entrada {idx} sem campo 'table' ou 'html'"
-                rows = table.get("rows")
-                if not rows or not isinstance(rows, list):
-                    return False, f"Tabela {idx} sem 'rows'"
-        return True, "OK"
-    
-    elif t == "chart":
-        chart = payload.get("chart", {})
-        if not chart:
-            return False, "Campo 'chart' ausente"
-        
-        # Valida estrutura ternária (triângulo de textura, etc)
-        ternary = chart.get("ternary")
-        if ternary:
-            if not isinstance(ternary, dict):
-                return False, "Campo 'ternary' com formato inválido"
-            
-            # Formato 1: ternary.axes + ternary.regions
-            axes = ternary.get("axes")
-            regions = ternary.get("regions")
-            if axes or regions:
-                return True, "OK"
-            
-            # Formato 2: ternary.a/b/c + chart.series ou chart.regions
-            has_abc = ternary.get("a") or ternary.get("b") or ternary.get("c")
-            series = chart.get("series")
-            regions = chart.get("regions") or ternary.get("regions")
-            if has_abc and (series is not None or regions):
-                return True, "OK"
-            
-            # Formato 3: só os eixos a/b/c (sem series)
-            if has_abc:
-                return True, "OK"
-            
-            return False, "Gráfico ternário sem estrutura reconhecida"
-        
-        # Valida estrutura x/series
-        if chart.get("x"):
-            x_vals = chart.get("x", {}).get("values", [])
-            series = chart.get("series", [])
-            if not x_vals or not series:
-                return False, "Gráfico com x ou series vazios"
-            if not isinstance(series, list) or len(series) == 0:
-                return False, "Series inválido ou vazio"
-            # Verifica se pelo menos uma série tem valores
-            has_values = any(s.get("values") for s in series if isinstance(s, dict))
-            if not has_values:
-                return False, "Nenhuma série contém valores"
-            return True, "OK"
-        
-        # Valida estrutura labels/series alternativa
-        labels = chart.get("labels")
-        series_as_rows = chart.get("series")
-        if labels and series_as_rows:
-            if not isinstance(labels, list) or not isinstance(series_as_rows, list):
-                return False, "Labels ou series com formato inválido"
-            if len(series_as_rows) == 0:
-                return False, "Series vazio"
-            return True, "OK"
-        
-        return False, "Estrutura de gráfico não reconhecida"
-    
-    return False, f"Tipo '{t}' não reconhecido"
+    # Tipo não-hashable (lista/dict vindos do modelo) quebraria o .get do dict
+    if not isinstance(t, str):
+        return False, f"Tipo '{t}' não reconhecido"
+    validator = _PAYLOAD_VALIDATORS.get(t)
+    if validator is None:
+        return False, f"Tipo '{t}' não reconhecido"
+    return validator(payload)
 
 
 def to_table_from_llm_payload(payload: dict) -> Optional[List[List[str]]]:
@@ -411,205 +1623,223 @@ def to_table_from_llm_payload(payload: dict) -> Optional[List[List[str]]]:
         logger.warning("Validação falhou: %s", msg)
         return None
     
-    t = payload.get("type")
-    if t == "table":
-        rows = payload.get("table", {}).get("rows") or []
-        headers = payload.get("table", {}).get("headers")
-        if headers:
-            result = [list(map(str, headers))] + [[str(c) for c in r] for r in rows]
-        else:
-            result = [[str(c) for c in r] for r in rows]
-        
-        # Remove linhas completamente vazias
-        result = [row for row in result if any(cell.strip() for cell in row)]
-        
-        if not result or len(result) < 1:
-            logger.warning("Tabela resultante vazia após limpeza")
-            return None
-        
-        return result
+    payload_type = payload.get("type")
+    if not isinstance(payload_type, str):
+        return None
+    renderer = _PAYLOAD_RENDERERS.get(payload_type)
+    return renderer(payload) if renderer else None
+
+
+def _render_table(payload: dict) -> Optional[List[List[str]]]:
+    table = payload.get("table") or {}
+    rows = table.get("rows") or []
+    headers = table.get("headers")
+    # Converte e descarta linhas completamente vazias numa única passada
+    # (`cell and not cell.isspace()` equivale a `cell.strip()` sem criar a string aparada).
+    # Células vindas do JSON já são str quase sempre: o teste de tipo exato evita a chamada a str()
+    result: List[List[str]] = []
+    for r in ([headers, *rows] if headers else rows):
+        row = [c if type(c) is str else str(c) for c in r]
+        if any(cell and not cell.isspace() for cell in row):
+            result.append(row)
     
-    if t == "chart":
-        chart = payload.get("chart", {})
-        
-        # Case 0: Ternary diagram (triângulo de textura, etc)
-        ternary = chart.get("ternary")
-        if ternary and isinstance(ternary, dict):
-            # Formato 1: ternary.axes (dict de eixos) + ternary.regions (lista)
-            axes = ternary.get("axes", {})
-            regions = ternary.get("regions", [])
-            
-            if axes and isinstance(axes, dict):
-                # Cria cabeçalho com os 3 eixos
-                axis_names = list(axes.keys())
-                header = ["Região/Classe"] + [axes[ax].get("label", ax) for ax in axis_names]
-                
-                table: List[List[str]] = [header]
-                
-                # Adiciona regiões
-                for region in regions:
-                    if isinstance(region, dict):
-                        name = region.get("name", "")
-                        # Se a região tiver valores dos eixos, adiciona
-                        row = [name]
-                        for ax in axis_names:
-                            val = region.get(ax, "")
-                            row.append(str(val) if val else "")
-                        table.append(row)
-                
-                # Se não tem regiões, pelo menos mostra os eixos e seus ticks
-                if len(table) == 1:
-                    for ax_name in axis_names:
-                        ax_data = axes.get(ax_name, {})
-                        label = ax_data.get("label", ax_name)
-                        ticks = ax_data.get("ticks", [])
-                        if ticks:
-                            tick_str = f"{min(ticks)}-{max(ticks)}"
-                        else:
-                            tick_str = ""
-                        table.append([label, tick_str, "", ""])
-                
-                return table if len(table) > 1 else None
-            
-            # Formato 2: ternary.a/b/c + chart.series (estrutura alternativa do GPT)
-            a_axis = ternary.get("a")
-            b_axis = ternary.get("b")
-            c_axis = ternary.get("c")
-            
-            if a_axis or b_axis or c_axis:
-                # Extrai labels dos eixos
-                labels = []
-                for axis in [a_axis, b_axis, c_axis]:
-                    if axis and isinstance(axis, dict):
-                        label = axis.get("label", "")
-                        labels.append(label)
-                
-                # Extrai ranges dos eixos (dos ticks/values)
-                axis_ranges = []
-                for axis_name in ['a', 'b', 'c']:
-                    axis_obj = ternary.get(axis_name)
-                    if axis_obj and isinstance(axis_obj, dict):
-                        ticks = axis_obj.get("ticks", []) or axis_obj.get("values", [])
-                        if ticks:
-                            try:
-                                nums = [float(v) for v in ticks if str(v).replace('.','').replace('-','').isdigit()]
-                                if nums:
-                                    range_str = f"{min(nums):.0f}-{max(nums):.0f}%"
-                                else:
-                                    range_str = f"{ticks[0]}-{ticks[-1]}%"
-                            except:
-                                range_str = f"{ticks[0]}-{ticks[-1]}%"
-                        else:
-                            range_str = "0-100%"
-                        axis_ranges.append(range_str)
-                    else:
-                        axis_ranges.append("-")
-                
-                # Cabeçalho com os ranges dos eixos
-                header_with_ranges = [f"{label}\n({range_val})" if range_val != "-" else label 
-                                     for label, range_val in zip(labels, axis_ranges)]
-                header = ["Região/Classe"] + header_with_ranges
-                table: List[List[str]] = [header]
-                
-                # Pega series do chart (fora do ternary)
-                series = chart.get("series", [])
-                
-                # Pega regions do chart (pode estar em chart.regions ou ternary.regions)
-                regions = chart.get("regions", []) or ternary.get("regions", [])
-                
-                # Prioriza regions (classes/regiões do diagrama)
-                if regions and isinstance(regions, list) and len(regions) > 0:
-                    for region in regions:
-                        if isinstance(region, dict):
-                            name = region.get("name", "")
-                            # Tenta pegar valores específicos da região (se existirem)
-                            vals = []
-                            for axis_name in ['a', 'b', 'c']:
-                                val = region.get(axis_name, "")
-                                if not val:
-                                    # Tenta com o nome completo do label
-                                    axis_obj = ternary.get(axis_name)
-                                    if axis_obj:
-                                        axis_label = axis_obj.get("label", "")
-                                        val = region.get(axis_label, "")
-                                vals.append(str(val) if val else "Varia")
-                            
-                            row = [name] + vals
-                            table.append(row)
-                # Se não tem regions, tenta series
-                elif series and isinstance(series, list) and len(series) > 0:
-                    for s in series:
-                        if isinstance(s, dict):
-                            name = s.get("name", "")
-                            values = s.get("values", [])
-                            # Se não tem values, deixa vazio
-                            row = [name] + ["Varia" for _ in labels]
-                            table.append(row)
-                
-                # Se não tem nem regions nem series, mostra apenas os eixos e ranges
-                if len(table) == 1:
-                    for axis, label in zip([a_axis, b_axis, c_axis], labels):
-                        if axis and isinstance(axis, dict):
-                            # Tenta 'values' primeiro, depois 'ticks'
-                            vals = axis.get("values", []) or axis.get("ticks", [])
-                            if vals:
-                                try:
-                                    nums = [float(v) for v in vals if str(v).replace('.','').replace('-','').isdigit()]
-                                    if nums:
-                                        range_str = f"{min(nums):.0f}-{max(nums):.0f}"
-                                    else:
-                                        range_str = ", ".join(str(v) for v in vals[:3])
-                                except:
-                                    range_str = ", ".join(str(v) for v in vals[:3])
-                            else:
-                                range_str = ""
-                            table.append([label, range_str, "", ""])
-                
-                return table if len(table) > 1 else None
-        
-        # Case 1: structured x/series arrays (OpenAI default)
-        if chart.get("x") and isinstance(chart.get("series"), list) and chart.get("series"):
-            x_vals = chart.get("x", {}).get("values", [])
-            series = chart.get("series", [])
-            x_label = chart.get("x", {}).get("label") or "x"
-            x_unit = chart.get("x", {}).get("unit", "")
-            if x_unit:
-                x_label = f"{x_label} ({x_unit})"
-            
-            header = [x_label] + [s.get("name") or f"serie_{i+1}" for i, s in enumerate(series)]
-            table: List[List[str]] = [header]
-            max_len = max(len(x_vals), *(len(s.get("values", [])) for s in series if isinstance(s, dict))) if series else len(x_vals)
-            
-            for i in range(max_len):
-                row = []
-                row.append(str(x_vals[i]) if i < len(x_vals) else "")
-                for s in series:
-                    if isinstance(s, dict):
-                        vals = s.get("values", [])
-                        v = vals[i] if i < len(vals) else None
-                        row.append("" if v is None else str(v))
-                    else:
-                        row.append("")
-                table.append(row)
-            
-            # Remove linhas vazias
-            table = [row for row in table if any(cell.strip() for cell in row)]
-            return table if len(table) > 1 else None
-        
-        # Case 2: LLM returned "labels" + list of dicts per row
-        labels = chart.get("labels")
-        series_as_rows = chart.get("series")
-        if isinstance(labels, list) and isinstance(series_as_rows, list) and series_as_rows:
-            header = [str(h) for h in labels]
-            table = [header]
-            for row in series_as_rows:
-                if isinstance(row, dict):
-                    ordered = []
-                    for h in header:
-                        ordered.append(str(row.get(h, "")))
-                    table.append(ordered)
-            return table if len(table) > 1 else None
-        
+    if not result:
+        logger.warning("Tabela resultante vazia após limpeza")
         return None
     
+    return result
+
+
+def _render_chart(payload: dict) -> Optional[List[List[str]]]:
+    chart = payload.get("chart") or {}
+    renderer = _CHART_RENDERERS.get(_chart_shape(chart))
+    return renderer(chart) if renderer else None
+
+
+def _chart_shape(chart: dict) -> Optional[str]:
+    """Identifica o formato do gráfico retornado pela LLM (chave de _CHART_RENDERERS)."""
+    # Case 0: Ternary diagram (triângulo de textura, etc)
+    ternary = chart.get("ternary")
+    if ternary and isinstance(ternary, dict):
+        axes = ternary.get("axes", {})
+        if axes and isinstance(axes, dict):
+            return "ternary_axes"
+        if ternary.get("a") or ternary.get("b") or ternary.get("c"):
+            return "ternary_abc"
+    
+    # Case 1: structured x/series arrays (OpenAI default)
+    series = chart.get("series")
+    if chart.get("x") and isinstance(series, list) and series:
+        return "xseries"
+    
+    # Case 2: LLM returned "labels" + list of dicts per row
+    if isinstance(chart.get("labels"), list) and isinstance(series, list) and series:
+        return "labels_series"
     return None
+
+
+def _safe_floats(values) -> List[float]:
+    """Converte para float só os valores com cara de número ("12", "-3.5"); ignora o resto."""
+    return [float(v) for v in values if _NUM_RE.fullmatch(str(v))]
+
+
+def _render_ternary_axes(chart: dict) -> Optional[List[List[str]]]:
+    """Formato 1: ternary.axes (dict de eixos) + ternary.regions (lista)."""
+    ternary = chart["ternary"]
+    axis_items = tuple(ternary["axes"].items())  # ((nome, dados do eixo), ...)
+    regions = ternary.get("regions", [])
+    
+    # Cria cabeçalho com os 3 eixos
+    header = ["Região/Classe", *(data.get("label", name) for name, data in axis_items)]
+    
+    table: List[List[str]] = [header]
+    
+    # Adiciona regiões
+    for region in regions:
+        if isinstance(region, dict):
+            # Se a região tiver valores dos eixos, adiciona
+            row = [region.get("name", "")]
+            for name, _ in axis_items:
+                val = region.get(name, "")
+                row.append(str(val) if val else "")
+            table.append(row)
+    
+    # Se não tem regiões, pelo menos mostra os eixos e seus ticks
+    if len(table) == 1:
+        for name, data in axis_items:
+            label = data.get("label", name)
+            ticks = data.get("ticks", [])
+            tick_str = f"{min(ticks)}-{max(ticks)}" if ticks else ""
+            table.append([label, tick_str, "", ""])
+    
+    return table if len(table) > 1 else None
+
+
+def _render_ternary_abc(chart: dict) -> Optional[List[List[str]]]:
+    """Formato 2: ternary.a/b/c + chart.series (estrutura alternativa do GPT)."""
+    ternary = chart["ternary"]
+    # Eixos válidos (dict não vazio) ou None, resolvidos uma vez para todo o resto da função
+    axis_objs = [
+        axis if axis and isinstance(axis, dict) else None
+        for axis in (ternary.get("a"), ternary.get("b"), ternary.get("c"))
+    ]
+    valid_axes = [axis for axis in axis_objs if axis is not None]
+    
+    # Extrai labels dos eixos
+    labels = [axis.get("label", "") for axis in valid_axes]
+    
+    # Extrai ranges dos eixos (dos ticks/values), alinhados com `labels`
+    axis_ranges = []
+    for axis_obj in valid_axes:
+        ticks = axis_obj.get("ticks", []) or axis_obj.get("values", [])
+        if not ticks:
+            axis_ranges.append("0-100%")
+            continue
+        nums = _safe_floats(ticks)
+        if nums:
+            axis_ranges.append(f"{min(nums):.0f}-{max(nums):.0f}%")
+        else:
+            axis_ranges.append(f"{ticks[0]}-{ticks[-1]}%")
+    
+    # Cabeçalho com os ranges dos eixos
+    header_with_ranges = [f"{label}\n({range_val})" for label, range_val in zip(labels, axis_ranges)]
+    table: List[List[str]] = [["Região/Classe"] + header_with_ranges]
+    
+    # Pega series do chart (fora do ternary)
+    series = chart.get("series", [])
+    
+    # Pega regions do chart (pode estar em chart.regions ou ternary.regions)
+    regions = chart.get("regions", []) or ternary.get("regions", [])
+    
+    # Prioriza regions (classes/regiões do diagrama)
+    if regions and isinstance(regions, list):
+        # (nome do eixo, label completo) por eixo, para buscar o valor de cada região
+        axis_keys = [
+            (axis_name, axis_obj.get("label", "") if axis_obj is not None else None)
+            for axis_name, axis_obj in zip(("a", "b", "c"), axis_objs)
+        ]
+        for region in regions:
+            if isinstance(region, dict):
+                # Tenta pegar valores específicos da região (se existirem)
+                vals = []
+                for axis_name, axis_label in axis_keys:
+                    val = region.get(axis_name, "")
+                    if not val and axis_label is not None:
+                        # Tenta com o nome completo do label
+                        val = region.get(axis_label, "")
+                    vals.append(str(val) if val else "Varia")
+                table.append([region.get("name", "")] + vals)
+    # Se não tem regions, tenta series
+    elif series and isinstance(series, list):
+        for s in series:
+            if isinstance(s, dict):
+                table.append([s.get("name", "")] + ["Varia" for _ in labels])
+    
+    # Se não tem nem regions nem series, mostra apenas os eixos e ranges
+    if len(table) == 1:
+        for axis, label in zip(valid_axes, labels):
+            # Tenta 'values' primeiro, depois 'ticks'
+            vals = axis.get("values", []) or axis.get("ticks", [])
+            if vals:
+                nums = _safe_floats(vals)
+                if nums:
+                    range_str = f"{min(nums):.0f}-{max(nums):.0f}"
+                else:
+                    range_str = ", ".join(str(v) for v in vals[:3])
+            else:
+                range_str = ""
+            table.append([label, range_str, "", ""])
+    
+    return table if len(table) > 1 else None
+
+
+def _render_xseries(chart: dict) -> Optional[List[List[str]]]:
+    x = chart["x"]
+    x_vals = x.get("values", [])
+    series = chart["series"]
+    x_label = x.get("label") or "x"
+    x_unit = x.get("unit", "")
+    if x_unit:
+        x_label = f"{x_label} ({x_unit})"
+
+    header = [x_label] + [s.get("name") or f"serie_{i+1}" for i, s in enumerate(series)]
+    table: List[List[str]] = [header]
+    # Uma coluna por série (série inválida vira coluna vazia); zip_longest completa com None
+    cols = [x_vals] + [(s.get("values") or ()) if isinstance(s, dict) else () for s in series]
+    for values in zip_longest(*cols):
+        row = ["" if v is None else str(v) for v in values]
+        # Descarta linhas vazias já na montagem (sem segundo passe)
+        if any(cell and not cell.isspace() for cell in row):
+            table.append(row)
+
+    return table if len(table) > 1 else None
+
+
+def _render_labels_series(chart: dict) -> Optional[List[List[str]]]:
+    labels = chart["labels"]
+    series_as_rows = chart["series"]
+    header = [h if type(h) is str else str(h) for h in labels]
+    table = [header]
+    for row in series_as_rows:
+        if isinstance(row, dict):
+            ordered = []
+            for h in header:
+                ordered.append(str(row.get(h, "")))
+            table.append(ordered)
+    return table if len(table) > 1 else None
+
+
+# Renderizador por formato de gráfico (ver _chart_shape)
+_CHART_RENDERERS = {
+    "ternary_axes": _render_ternary_axes,
+    "ternary_abc": _render_ternary_abc,
+    "xseries": _render_xseries,
+    "labels_series": _render_labels_series,
+}
+
+
+# Conversão para linhas por tipo de payload (table_set/text não viram uma tabela única)
+_PAYLOAD_RENDERERS = {
+    "table": _render_table,
+    "chart": _render_chart,
+}
@@ -1,25 +1,43 @@
 from __future__ import annotations
 
 import logging
+import os
+import sys
 from typing import Optional
 
-from rich.logging import RichHandler
-
 
 _LOGGER_CONFIGURED = False
 
 
+def _use_rich() -> bool:
+    # Rich só vale a pena no terminal: em lote/worker (sem TTY) evita o import pesado
+    # (pygments, markdown-it) e a formatação cara por registro
+    if os.getenv("EXTRACTOR_RICH", "1").strip().lower() in ("0", "false", "no", "off"):
+        return False
+    return sys.stdout.isatty()
+
+
+def _build_handler() -> logging.Handler:
+    if _use_rich():
+        from rich.logging import RichHandler
+
+        return RichHandler(
+            rich_tracebacks=True,
+            show_time=True,
+            show_path=False,
+        )
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    return handler
+
+
 def get_logger(name: Optional[str] = None) -> logging.Logger:
     global _LOGGER_CONFIGURED
     logger_name = name or "extractor"
     logger = logging.getLogger(logger_name)
 
     if not _LOGGER_CONFIGURED:
-        handler = RichHandler(
-            rich_tracebacks=True,
-            show_time=True,
-            show_path=False,
-        )
+        handler = _build_handler()
         handler.setLevel(logging.INFO)
 
         root = logging.getLogger()
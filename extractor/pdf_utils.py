@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterable, List, Optional, Sequence, Tuple
 
@@ -13,6 +18,18 @@ from .logging_utils import get_logger
 
 logger = get_logger(__name__)
 
+_SPAWN = multiprocessing.get_context("spawn")
+
+# zlib nível 1 nos PNGs das páginas: a 900 DPI a compressão padrão domina o tempo de
+# rasterização; o arquivo fica maior, mas continua sem perdas (letras pequenas intactas)
+_PNG_COMPRESS_LEVEL = 1
+
+# Filtros de imagem cujo stream bruto já é um arquivo válido (extensão como a do extract_image)
+_PASSTHROUGH_FILTERS = {"DCTDecode": "jpeg", "JPXDecode": "jpx"}
+
+_PAGE_NUM_RE = re.compile(r"^\d+$")
+_PAGE_RANGE_RE = re.compile(r"^(\d+)-(\d+)$")
+
 
 @dataclass
 class PageImage:
@@ -40,12 +57,12 @@ def parse_pages(pages: Optional[str], page_count: int) -> List[int]:
         part = part.strip()
         if not part:
             continue
-        if re.match(r"^\d+$", part):
+        if _PAGE_NUM_RE.match(part):
             n = int(part)
             if 1 <= n <= page_count:
                 result.append(n)
             continue
-        m = re.match(r"^(\d+)-(\d+)$", part)
+        m = _PAGE_RANGE_RE.match(part)
         if m:
             a, b = map(int, m.groups())
             if a > b:
@@ -54,13 +71,7 @@ def parse_pages(pages: Optional[str], page_count: int) -> List[int]:
             b = min(page_count, b)
             result.extend(range(a, b + 1))
     # Dedupe keeping order
-    seen = set()
-    ordered = []
-    for n in result:
-        if n not in seen:
-            seen.add(n)
-            ordered.append(n)
-    return ordered
+    return list(dict.fromkeys(result))
 
 
 def ensure_dir(path: Path) -> None:
@@ -72,9 +83,10 @@ def extract_text(doc: fitz.Document, out_dir: Path, pages: Sequence[int]) -> Non
     logger.info("Extraindo texto para %s", out_dir)
     for pno in pages:
         page = doc[pno - 1]
-        text = page.get_text("text")
+        # sort=False: ordem do stream do PDF, sem ordenar os blocos
+        text = page.get_text("text", sort=False)
         path = out_dir / f"page-{pno:03d}.txt"
-        path.write_text(text, encoding="utf-8")
+        path.write_bytes(text.encode("utf-8"))
         logger.debug("Página %s -> %s", pno, path)
 
 
@@ -89,12 +101,18 @@ def extract_images(doc: fitz.Document, out_dir: Path, pages: Sequence[int]) -> L
         if not images:
             continue
         for img_index, img in enumerate(images, start=1):
-            xref = img[0]
-            base = doc.extract_image(xref)
-            image_bytes = base["image"]
-            ext = base.get("ext", "png")
-            width = base.get("width", 0)
-            height = base.get("height", 0)
+            xref, smask, width, height = img[0], img[1], img[2], img[3]
+            ext = _PASSTHROUGH_FILTERS.get(img[8]) if not smask else None
+            if ext is not None:
+                # Stream já codificado (JPEG/JPEG 2000): grava os bytes como estão no PDF,
+                # com as dimensões da própria listagem, sem passar pelo extract_image
+                image_bytes = doc.xref_stream_raw(xref)
+            else:
+                base = doc.extract_image(xref)
+                image_bytes = base["image"]
+                ext = base.get("ext", "png")
+                width = base.get("width", 0)
+                height = base.get("height", 0)
             path = out_dir / f"page-{pno:03d}-img-{img_index:04d}.{ext}"
             path.write_bytes(image_bytes)
             extracted.append(ExtractedImage(pno, img_index, path, width, height))
@@ -102,7 +120,14 @@ def extract_images(doc: fitz.Document, out_dir: Path, pages: Sequence[int]) -> L
     return extracted
 
 
-def render_pages(doc: fitz.Document, out_dir: Path, pages: Sequence[int], dpi: int = 300, force: bool = False) -> List[PageImage]:
+def render_pages(
+    doc: fitz.Document,
+    out_dir: Path,
+    pages: Sequence[int],
+    dpi: int = 300,
+    force: bool = False,
+    max_workers: Optional[int] = None,
+) -> List[PageImage]:
     """
     Render pages to PNGs for OCR. Returns list of PageImage objects.
     
@@ -112,13 +137,13 @@ def render_pages(doc: fitz.Document, out_dir: Path, pages: Sequence[int], dpi: i
         pages: List of page numbers (1-based) to render
         dpi: Resolution for rendering (default 300)
         force: If True, re-render even if PNG already exists (default False)
+        max_workers: Rendering processes (default: os.cpu_count(); 1 renders serially)
     
     Returns:
         List of PageImage objects (existing or newly created)
     """
     ensure_dir(out_dir)
-    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
-    
+
     # Checkpoint: Separa páginas que já existem das que precisam ser renderizadas
     pages_to_render = []
     pages_existing = []
@@ -127,8 +152,8 @@ def render_pages(doc: fitz.Document, out_dir: Path, pages: Sequence[int], dpi: i
     for pno in pages:
         path = out_dir / f"page-{pno:03d}.png"
         
-        # Verifica se arquivo existe e é válido
-        if not force and path.exists() and path.stat().st_size > 0:
+        # Verifica se arquivo existe e é válido (um único stat)
+        if not force and _file_size(path) > 0:
             pages_existing.append(pno)
             res.append(PageImage(pno, path))
         else:
@@ -157,49 +182,93 @@ def render_pages(doc: fitz.Document, out_dir: Path, pages: Sequence[int], dpi: i
         _format_page_range(pages_to_render)
     )
     
+    workers = min(max_workers or os.cpu_count() or 1, len(pages_to_render))
+    pdf_path = doc.name
+    if workers > 1 and pdf_path and Path(pdf_path).is_file():
+        try:
+            # Um processo por núcleo: a codificação do PNG segura o GIL, então threads não escalam.
+            # Cada processo abre o PDF uma vez (_open_render_doc) e recebe só o número da página.
+            # spawn e não fork: outra thread pode estar no meio do import/aquecimento do Paddle
+            # (EXTRACTOR_PRELOAD) segurando locks que o filho herdaria travados
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_SPAWN) as pool:
+                paths = list(pool.map(
+                    _render_one,
+                    [pdf_path] * len(pages_to_render),
+                    pages_to_render,
+                    [dpi] * len(pages_to_render),
+                    [out_dir.as_posix()] * len(pages_to_render),
+                ))
+        except (OSError, BrokenProcessPool) as exc:
+            logger.warning("Rasterização paralela indisponível (%s); seguindo em série.", exc)
+        else:
+            res.extend(PageImage(pno, path) for pno, path in zip(pages_to_render, paths))
+            return res
+
+    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
     for pno in pages_to_render:
-        page = doc[pno - 1]
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        path = out_dir / f"page-{pno:03d}.png"
-        pix.save(path.as_posix())
+        path = _render_page(doc, pno, mat, out_dir)
         res.append(PageImage(pno, path))
-        logger.debug("Página %s rasterizada em %s", pno, path)
-    
+
     return res
 
 
+@lru_cache(maxsize=1)
+def _open_render_doc(pdf_path: str) -> fitz.Document:
+    """PDF aberto uma vez por processo de rasterização."""
+    return fitz.open(pdf_path)
+
+
+def _render_one(pdf_path: str, pno: int, dpi: int, out_dir: str) -> Path:
+    """Tarefa do pool de processos: rasteriza uma página e devolve o caminho do arquivo."""
+    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    return _render_page(_open_render_doc(pdf_path), pno, mat, Path(out_dir))
+
+
+def _render_page(doc: fitz.Document, pno: int, mat: "fitz.Matrix", out_dir: Path) -> Path:
+    page = doc[pno - 1]
+    pix = page.get_pixmap(matrix=mat, alpha=False)
+    path = out_dir / f"page-{pno:03d}.png"
+    # Imagem PIL sobre o próprio buffer do pixmap (samples_mv): o pil_save copiaria a
+    # página duas vezes (samples + frombytes), ~250 MB cada a 900 DPI
+    img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
+    img.save(
+        path.as_posix(),
+        format="PNG",
+        compress_level=_PNG_COMPRESS_LEVEL,
+        dpi=(pix.xres, pix.yres),
+    )
+    logger.debug("Página %s rasterizada em %s", pno, path)
+    return path
+
+
+def _file_size(path: Path) -> int:
+    """Tamanho do arquivo em bytes, ou 0 se não existir."""
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
 def _format_page_range(pages: List[int]) -> str:
     """Formata lista de páginas de forma compacta (ex: 1-5, 8, 10-12)"""
     if not pages:
         return ""
-    
-    if len(pages) > 10:
-        # Se muitas páginas, mostra apenas range completo
-        return f"{min(pages)}-{max(pages)}"
-    
-    # Agrupa páginas consecutivas
-    sorted_pages = sorted(pages)
+
+    # As listas do render_pages já vêm em ordem: só ordena se precisar
+    if any(a > b for a, b in zip(pages, pages[1:])):
+        pages = sorted(pages)
+
+    # Agrupa páginas consecutivas numa única passada
     ranges = []
-    start = sorted_pages[0]
-    end = sorted_pages[0]
-    
-    for i in range(1, len(sorted_pages)):
-        if sorted_pages[i] == end + 1:
-            end = sorted_pages[i]
-        else:
-            if start == end:
-                ranges.append(str(start))
-            else:
-                ranges.append(f"{start}-{end}")
-            start = sorted_pages[i]
-            end = sorted_pages[i]
-    
-    # Adiciona último range
-    if start == end:
-        ranges.append(str(start))
-    else:
-        ranges.append(f"{start}-{end}")
-    
+    start = end = pages[0]
+    for pno in pages[1:]:
+        if pno == end + 1:
+            end = pno
+            continue
+        ranges.append(str(start) if start == end else f"{start}-{end}")
+        start = end = pno
+    ranges.append(str(start) if start == end else f"{start}-{end}")
+
     return ", ".join(ranges)
 
 
@@ -1,21 +1,27 @@
 from __future__ import annotations
 
 import os
+import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 from rich import print
 from rich.prompt import Confirm, Prompt
 from rich.table import Table
-from dotenv import load_dotenv
 
 from .image_tables import ImageProcessingConfig, process_pdf_images
+from .llm_vision import load_dotenv_once
 from .logging_utils import get_logger
 
 
 logger = get_logger(__name__)
 
+# Item da seleção de PDFs: "3" ou "3-5" (espaços tolerados)
+_CHOICE_PART_RE = re.compile(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?")
+
 
 def _env_any(*names: str, default: str | None = None) -> str | None:
     for name in names:
@@ -32,6 +38,20 @@ def _env_flag(name: str, default: bool | None = False) -> bool | None:
     return val.strip().lower() in {"1", "true", "yes", "on"}
 
 
+@lru_cache(maxsize=1)
+def _precheck_azure_env() -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """
+    Deployment Azure do modelo barato (pre-check / GPT-4.1), lido do ambiente uma vez só.
+    Retorna: (endpoint, api_key, deployment, api_version); cada chamador aplica seus padrões.
+    """
+    return (
+        _env_any("AZURE_OPENAI_PRECHECK_ENDPOINT", "AZURE_OPENAI_ENDPOINT_PRECHECK", "AZURE_GPT41_ENDPOINT"),
+        _env_any("AZURE_OPENAI_PRECHECK_API_KEY", "AZURE_OPENAI_API_KEY_PRECHECK", "AZURE_GPT41_API_KEY"),
+        _env_any("AZURE_OPENAI_PRECHECK_DEPLOYMENT", "AZURE_OPENAI_DEPLOYMENT_PRECHECK", "AZURE_GPT41_DEPLOYMENT"),
+        _env_any("AZURE_OPENAI_PRECHECK_API_VERSION", "AZURE_OPENAI_API_VERSION_PRECHECK", "AZURE_GPT41_API_VERSION"),
+    )
+
+
 def _list_pdfs(docs_dir: Path) -> List[Path]:
     return sorted([p for p in docs_dir.glob("*.pdf") if p.is_file()])
 
@@ -47,31 +67,16 @@ def _choose_pdfs(pdfs: List[Path]) -> List[Path]:
     if not choice.strip():
         return pdfs
 
-    # parse ranges
-    idxs: List[int] = []
+    # parse ranges ("1,3-5"); partes inválidas são ignoradas, índices repetidos contam uma vez
+    idxs = set()
     for part in choice.split(','):
-        part = part.strip()
-        if not part:
+        m = _CHOICE_PART_RE.fullmatch(part)
+        if not m:
             continue
-        if '-' in part:
-            a, b = part.split('-', 1)
-            try:
-                a_i = int(a)
-                b_i = int(b)
-            except ValueError:
-                continue
-            if a_i > b_i:
-                a_i, b_i = b_i, a_i
-            idxs.extend(list(range(a_i, b_i + 1)))
-        else:
-            try:
-                idxs.append(int(part))
-            except ValueError:
-                pass
-    sel = []
-    for i in idxs:
-        if 1 <= i <= len(pdfs):
-            sel.append(pdfs[i - 1])
+        a = int(m.group(1))
+        b = int(m.group(2) or a)
+        idxs.update(range(min(a, b), max(a, b) + 1))
+    sel = [pdfs[i - 1] for i in sorted(idxs) if 1 <= i <= len(pdfs)]
     return sel or pdfs
 
 
@@ -92,10 +97,9 @@ def _auto_detect_precheck_model(llm_cfg: dict) -> tuple:
     """
     # Prioridade 1: GPT-4.1 (Azure) - SEMPRE preferido para pre-check
     if llm_cfg.get("provider") == "azure":
-        az_pre_ep = _env_any("AZURE_OPENAI_PRECHECK_ENDPOINT", "AZURE_GPT41_ENDPOINT")
-        az_pre_key = _env_any("AZURE_OPENAI_PRECHECK_API_KEY", "AZURE_GPT41_API_KEY")
-        az_pre_dep = _env_any("AZURE_OPENAI_PRECHECK_DEPLOYMENT", "AZURE_GPT41_DEPLOYMENT", default="gpt-4o")
-        az_pre_ver = _env_any("AZURE_OPENAI_PRECHECK_API_VERSION", "AZURE_GPT41_API_VERSION", default="2025-03-01-preview")
+        az_pre_ep, az_pre_key, az_pre_dep, az_pre_ver = _precheck_azure_env()
+        az_pre_dep = az_pre_dep or "gpt-4o"
+        az_pre_ver = az_pre_ver or "2025-03-01-preview"
         
         if az_pre_ep and az_pre_key:
             logger.info("✅ Pre-check: GPT-4.1 (Azure) detectado automaticamente")
@@ -145,10 +149,9 @@ def _ask_extraction_model(llm_cfg: dict) -> tuple:
     
     # Opção 2: GPT-4.1 (se disponível)
     if llm_cfg.get("provider") == "azure":
-        az_pre_ep = _env_any("AZURE_OPENAI_PRECHECK_ENDPOINT", "AZURE_GPT41_ENDPOINT")
-        az_pre_key = _env_any("AZURE_OPENAI_PRECHECK_API_KEY", "AZURE_GPT41_API_KEY")
-        az_pre_dep = _env_any("AZURE_OPENAI_PRECHECK_DEPLOYMENT", "AZURE_GPT41_DEPLOYMENT", default="gpt-4.1")
-        az_pre_ver = _env_any("AZURE_OPENAI_PRECHECK_API_VERSION", "AZURE_GPT41_API_VERSION", default="2025-03-01-preview")
+        az_pre_ep, az_pre_key, az_pre_dep, az_pre_ver = _precheck_azure_env()
+        az_pre_dep = az_pre_dep or "gpt-4.1"
+        az_pre_ver = az_pre_ver or "2025-03-01-preview"
         
         if az_pre_ep and az_pre_key:
             options.append(("GPT-4.1 (mais rápido/barato)", az_pre_dep, "azure", az_pre_ep, az_pre_ver, az_pre_key))
@@ -186,27 +189,8 @@ def _detect_llm_config() -> dict:
         "AZURE_GPT5_DEPLOYMENT",
         default="gpt-5",
     )
-    az_pre_ep = _env_any(
-        "AZURE_OPENAI_PRECHECK_ENDPOINT",
-        "AZURE_OPENAI_ENDPOINT_PRECHECK",
-        "AZURE_GPT41_ENDPOINT",
-    )
-    az_pre_key = _env_any(
-        "AZURE_OPENAI_PRECHECK_API_KEY",
-        "AZURE_OPENAI_API_KEY_PRECHECK",
-        "AZURE_GPT41_API_KEY",
-    )
-    az_pre_ver = _env_any(
-        "AZURE_OPENAI_PRECHECK_API_VERSION",
-        "AZURE_OPENAI_API_VERSION_PRECHECK",
-        "AZURE_GPT41_API_VERSION",
-        default=az_ver,
-    )
-    az_pre_dep = _env_any(
-        "AZURE_OPENAI_PRECHECK_DEPLOYMENT",
-        "AZURE_OPENAI_DEPLOYMENT_PRECHECK",
-        "AZURE_GPT41_DEPLOYMENT",
-    )
+    az_pre_ep, az_pre_key, az_pre_dep, az_pre_ver = _precheck_azure_env()
+    az_pre_ver = az_pre_ver or az_ver
     oi_key = os.getenv("OPENAI_API_KEY")
     oi_model = os.getenv("OPENAI_MODEL", "gpt-5")
     or_key = os.getenv("OPENROUTER_API_KEY")
@@ -282,9 +266,62 @@ def _detect_llm_config() -> dict:
     return options[int(choice) - 1]["config"]
 
 
+def _process_one_pdf(
+    pdf: Path,
+    out_dir: Path,
+    done_dir: Path,
+    pages: Optional[str],
+    config: ImageProcessingConfig,
+) -> None:
+    """Processa um PDF e o move para docs-gerados (top-level: roda também num processo do pool)."""
+    logger.info("Processando %s", pdf)
+    try:
+        base_output = out_dir / pdf.stem
+        base_output.mkdir(parents=True, exist_ok=True)
+        results = process_pdf_images(
+            pdf,
+            base_output,
+            pages,
+            img_dir_name="images",
+            tables_dir_name="llm_tables",
+            config=config,
+        )
+        if results:
+            print(f"[cyan]{len(results)} tabelas/séries salvas em {base_output / 'llm_tables'}[/cyan]")
+        else:
+            print(f"[yellow]Nenhuma tabela reconhecida para {pdf.name}[/yellow]")
+
+        # 🚧 MODO TESTE: NÃO move PDF (para facilitar testes)
+        # Quando finalizar testes, descomente o código abaixo
+        
+        # move PDF para docs-gerados
+        target = done_dir / pdf.name
+        # evitar overwrite
+        if target.exists():
+            base = target.stem
+            ext = target.suffix
+            i = 1
+            while True:
+                alt = done_dir / f"{base}-{i}{ext}"
+                if not alt.exists():
+                    target = alt
+                    break
+                i += 1
+        try:
+            # Mesmo sistema de arquivos (o caso comum): um único rename
+            pdf.rename(target)
+        except OSError:
+            shutil.move(str(pdf), str(target))
+        logger.info("PDF original movido para %s", target)
+        
+        logger.info("✅ PDF mantido em docs/ (modo teste)")
+    except Exception as e:
+        logger.exception("Falha ao processar %s", pdf)
+
+
 def main() -> None:
     # Carrega .env se existir
-    load_dotenv()
+    load_dotenv_once()
     docs_dir = Path("docs")
     out_dir = Path("output")
     done_dir = Path("docs-gerados")
@@ -355,16 +392,46 @@ def main() -> None:
     llm_cfg["api_key"] = extraction_api_key
     
     # Valores padrão otimizados
-    render_dpi_val = 900  # DPI alto para letras muito pequenas serem legíveis
+    # DPI alto para letras muito pequenas serem legíveis; EXTRACTOR_RENDER_DPI reduz para PDFs comuns
+    try:
+        render_dpi_val = max(72, int(os.getenv("EXTRACTOR_RENDER_DPI", "900")))
+    except ValueError:
+        render_dpi_val = 900
     try:
         llm_max_workers = int(os.getenv("LLM_MAX_WORKERS", "3"))
     except ValueError:
         llm_max_workers = 6
     llm_max_workers = max(1, llm_max_workers)
+    try:
+        precheck_max_workers = max(1, int(os.getenv("PRECHECK_MAX_WORKERS", "8")))
+    except ValueError:
+        precheck_max_workers = 8
+    try:
+        precheck_group_size = max(1, int(os.getenv("PRECHECK_GROUP_SIZE", "1")))
+    except ValueError:
+        precheck_group_size = 1
+    try:
+        text_group_size = max(1, int(os.getenv("TEXT_GROUP_SIZE", "4")))
+    except ValueError:
+        text_group_size = 4
+    try:
+        render_max_workers = max(0, int(os.getenv("RENDER_MAX_WORKERS", "0"))) or None
+    except ValueError:
+        render_max_workers = None
     
     # PRE-CHECK: Sempre ativo (já detectado automaticamente)
     use_precheck = True
+    # PRECHECK_BATCH: pre-check via Batch API (~50% do custo, mas pode levar horas)
+    precheck_batch = bool(_env_flag("PRECHECK_BATCH", default=False))
+    if precheck_batch:
+        logger.info("📦 PRECHECK_BATCH ativado - pre-check das páginas via Batch API")
     
+    # EXTRACTOR_DEBUG_LLM: grava também a resposta bruta de cada segmento (segment-XX.json)
+    debug_llm = bool(_env_flag("EXTRACTOR_DEBUG_LLM", default=False))
+
+    # EXTRACTOR_PRELOAD: carrega o PPStructure em background enquanto as páginas são renderizadas
+    preload_layout = bool(_env_flag("EXTRACTOR_PRELOAD", default=False))
+
     # OCR: Inicializa como True (será decidido automaticamente pelo sistema baseado em content_count)
     use_layout_ocr = True
     
@@ -395,66 +462,58 @@ def main() -> None:
     else:
         logger.info("✅ Checkpoint ativado - páginas já processadas serão puladas")
 
-    for pdf in sel:
-        logger.info("Processando %s", pdf)
-        try:
-            base_output = out_dir / pdf.stem
-            base_output.mkdir(parents=True, exist_ok=True)
-            config = ImageProcessingConfig(
-                model=extraction_model,
-                provider=extraction_provider,
-                azure_endpoint=extraction_endpoint or llm_cfg.get("endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT"),
-                azure_api_version=extraction_api_version or llm_cfg.get("api_version") or os.getenv("AZURE_OPENAI_API_VERSION", "2025-03-01-preview"),
-                api_key=extraction_api_key or llm_cfg.get("api_key") or os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY"),
-                openrouter_api_key=llm_cfg.get("openrouter_api_key") or os.getenv("OPENROUTER_API_KEY"),
-                cheap_model=cheap_model,
-                cheap_provider=cheap_provider,
-                cheap_api_key=cheap_api_key,
-                cheap_azure_endpoint=cheap_endpoint,
-                cheap_azure_api_version=cheap_api_version,
-                render_dpi=render_dpi_val,
-                use_cheap_precheck=use_precheck,
-                llm_max_workers=llm_max_workers,
-                use_layout_ocr=use_layout_ocr,
-                skip_ocr_pages=skip_ocr_pages,
-                force_reprocess=force_reprocess,
-                convert_text_only=convert_text_only,
-            )
-            results = process_pdf_images(
-                pdf,
-                base_output,
-                pages,
-                img_dir_name="images",
-                tables_dir_name="llm_tables",
-                config=config,
-            )
-            if results:
-                print(f"[cyan]{len(results)} tabelas/séries salvas em {base_output / 'llm_tables'}[/cyan]")
-            else:
-                print(f"[yellow]Nenhuma tabela reconhecida para {pdf.name}[/yellow]")
-
-            # 🚧 MODO TESTE: NÃO move PDF (para facilitar testes)
-            # Quando finalizar testes, descomente o código abaixo
-            
-            # move PDF para docs-gerados
-            target = done_dir / pdf.name
-            # evitar overwrite
-            if target.exists():
-                base = target.stem
-                ext = target.suffix
-                i = 1
-                while True:
-                    alt = done_dir / f"{base}-{i}{ext}"
-                    if not alt.exists():
-                        target = alt
-                        break
-                    i += 1
-            shutil.move(str(pdf), str(target))
-            logger.info("PDF original movido para %s", target)
-            
-            logger.info("✅ PDF mantido em docs/ (modo teste)")
-        except Exception as e:
-            logger.exception("Falha ao processar %s", pdf)
+    config = ImageProcessingConfig(
+        model=extraction_model,
+        provider=extraction_provider,
+        azure_endpoint=extraction_endpoint or llm_cfg.get("endpoint") or os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_api_version=extraction_api_version or llm_cfg.get("api_version") or os.getenv("AZURE_OPENAI_API_VERSION", "2025-03-01-preview"),
+        api_key=extraction_api_key or llm_cfg.get("api_key") or os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY"),
+        openrouter_api_key=llm_cfg.get("openrouter_api_key") or os.getenv("OPENROUTER_API_KEY"),
+        cheap_model=cheap_model,
+        cheap_provider=cheap_provider,
+        cheap_api_key=cheap_api_key,
+        cheap_azure_endpoint=cheap_endpoint,
+        cheap_azure_api_version=cheap_api_version,
+        render_dpi=render_dpi_val,
+        render_max_workers=render_max_workers,
+        use_cheap_precheck=use_precheck,
+        precheck_batch=precheck_batch,
+        llm_max_workers=llm_max_workers,
+        precheck_max_workers=precheck_max_workers,
+        precheck_group_size=precheck_group_size,
+        use_layout_ocr=use_layout_ocr,
+        skip_ocr_pages=skip_ocr_pages,
+        debug_llm=debug_llm,
+        preload_layout=preload_layout,
+        force_reprocess=force_reprocess,
+        convert_text_only=convert_text_only,
+        text_group_size=text_group_size,
+    )
+
+    # PDF_MAX_WORKERS: PDFs processados em paralelo, um processo cada (padrão: 1, em série).
+    # Cada PDF já usa vários núcleos na rasterização: divide-os entre os PDFs simultâneos
+    try:
+        pdf_workers = min(len(sel), max(1, int(os.getenv("PDF_MAX_WORKERS", "1"))))
+    except ValueError:
+        pdf_workers = 1
+    if pdf_workers <= 1:
+        for pdf in sel:
+            _process_one_pdf(pdf, out_dir, done_dir, pages, config)
+    else:
+        if config.render_max_workers is None:
+            config.render_max_workers = max(1, (os.cpu_count() or 1) // pdf_workers)
+        logger.info("Processando %d PDFs, %d em paralelo", len(sel), pdf_workers)
+        with ProcessPoolExecutor(max_workers=pdf_workers) as pool:
+            futures = {
+                pool.submit(_process_one_pdf, pdf, out_dir, done_dir, pages, config): pdf
+                for pdf in sel
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    # _process_one_pdf já loga as falhas do PDF; aqui só o processo que morreu
+                    logger.exception("Falha ao processar %s", futures[future])
 
     print("\n[bold]Concluído.[/bold]")
 
@@ -12,15 +12,108 @@ Uso:
 
 from __future__ import annotations
 
+import logging
+import re
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Sequence, Tuple
 from html import escape
 
+from .json_utils import write_json_pretty
 from .logging_utils import get_logger
-from .llm_vision import call_openai_vision_json
+from .llm_vision import call_openai_vision_json, call_openai_vision_json_grouped
 
 logger = get_logger(__name__)
 
+# Marcação inline do prompt (**negrito**, *itálico*), ver _format_inline_text
+_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+_ITALIC_RE = re.compile(r'\*([^*]+)\*')
+
+# Início/fim fixos do page-text.html (CSS incluso), codificados uma vez só
+_TEXT_HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {
+            font-family: 'Georgia', 'Times New Roman', serif;
+            padding: 40px;
+            max-width: 800px;
+            margin: 0 auto;
+            background: #fafafa;
+            line-height: 1.6;
+        }
+        .container {
+            background: #fff;
+            padding: 40px;
+            border-radius: 8px;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+        }
+        h1 {
+            font-size: 2em;
+            margin-bottom: 20px;
+            color: #2c3e50;
+            border-bottom: 3px solid #3498db;
+            padding-bottom: 10px;
+        }
+        h2 {
+            font-size: 1.5em;
+            margin-top: 30px;
+            margin-bottom: 15px;
+            color: #34495e;
+        }
+        h3 {
+            font-size: 1.2em;
+            margin-top: 20px;
+            margin-bottom: 10px;
+            color: #555;
+        }
+        p {
+            margin-bottom: 15px;
+            text-align: justify;
+            color: #333;
+        }
+        ul, ol {
+            margin-bottom: 15px;
+            padding-left: 30px;
+        }
+        li {
+            margin-bottom: 8px;
+            color: #333;
+        }
+        blockquote {
+            border-left: 4px solid #3498db;
+            margin: 20px 0;
+            padding: 10px 20px;
+            background: #ecf0f1;
+            font-style: italic;
+        }
+        .reference {
+            font-size: 0.9em;
+            color: #666;
+            margin-left: 20px;
+        }
+        strong {
+            color: #2c3e50;
+        }
+    </style>
+</head>
+<body>
+<div class="container">
+""".encode("utf-8")
+_TEXT_HTML_TAIL = b"""</div>
+</body>
+</html>"""
+
+# Uma página renderizada tem centenas de KB; abaixo disso o PNG está vazio/truncado
+_MIN_IMAGE_BYTES = 1024
+
+# Seções de texto simples (fora heading/list) -> tags de abertura/fechamento
+_TEXT_SECTION_TAGS = {
+    "paragraph": ("<p>", "</p>"),
+    "blockquote": ("<blockquote>", "</blockquote>"),
+    "reference": ("<p class='reference'>", "</p>"),
+}
+
 
 # =============================================================================
 # PROMPT PARA EXTRAÇÃO DE TEXTO
@@ -89,11 +182,30 @@ TEXT_EXTRACTION_PROMPT = """Você verá uma página contendo APENAS TEXTO (sem t
 
 Retorne APENAS JSON válido."""
 
+# Complemento do prompt quando várias páginas vão na mesma requisição (extract_text_batch)
+TEXT_BATCH_SUFFIX = """
+
+**VÁRIAS PÁGINAS:** Você recebeu {count} imagens, cada uma é uma página diferente, na ordem.
+Retorne {{"pages": [...]}} com exatamente {count} objetos no formato acima, um por imagem e na mesma ordem."""
+
 
 # =============================================================================
 # FUNÇÕES PRINCIPAIS
 # =============================================================================
 
+def _usable_image(image_path: Path, page_id: str) -> bool:
+    """Confere com um stat se a imagem existe e não está truncada, antes de gastar uma chamada à LLM."""
+    try:
+        size = image_path.stat().st_size
+    except OSError as e:
+        logger.warning("Imagem da página %s indisponível (%s); texto não extraído", page_id, e)
+        return False
+    if size < _MIN_IMAGE_BYTES:
+        logger.warning("Imagem da página %s com %d bytes (truncada?); texto não extraído", page_id, size)
+        return False
+    return True
+
+
 def extract_text_from_page(
     image_path: Path,
     page_out: Path,
@@ -125,6 +237,8 @@ def extract_text_from_page(
         Tupla (html_path, summary_entry) ou (None, None) se falhar
     """
     logger.info("📄 Extraindo texto completo da página %s (text-only)", page_id)
+    if not _usable_image(image_path, page_id):
+        return None, None
     
     try:
         payload = call_openai_vision_json(
@@ -143,40 +257,131 @@ def extract_text_from_page(
         if not payload:
             logger.warning("GPT-5 não retornou dados para página %s (text-only)", page_id)
             return None, None
-        
-        # Salva JSON bruto
-        import json
-        (page_out / "page-text.json").write_text(
-            json.dumps(payload, ensure_ascii=False, indent=2),
-            encoding="utf-8"
-        )
-        
-        # Converte para HTML
-        html_content = _payload_to_html(payload)
-        if not html_content:
-            logger.warning("Falha ao converter payload para HTML (página %s)", page_id)
-            return None, None
-        
-        # Salva HTML
-        title = payload.get("title") or f"Página {page_id}"
-        html_path = _save_text_html(html_content, page_out, title)
-        
-        if html_path:
-            logger.info("✅ Texto extraído e salvo: %s", html_path.name)
-            summary_entry = {
-                "page": page_id,
-                "table": "text",  # Identificador especial para texto
-                "html": html_content,
-            }
-            return html_path, summary_entry
-        
-        return None, None
+
+        return _save_text_payload(payload, page_out, page_id)
         
     except Exception as e:
         logger.error("Erro ao extrair texto da página %s: %s", page_id, e)
         return None, None
 
 
+def extract_text_batch(
+    pages: Sequence[Tuple[Path, Path, str]],
+    model: str,
+    provider: Optional[str],
+    api_key: Optional[str],
+    azure_endpoint: Optional[str],
+    azure_api_version: Optional[str],
+    openrouter_api_key: Optional[str],
+    locale: str,
+) -> List[Tuple[Optional[Path], Optional[Dict[str, str]]]]:
+    """
+    Extrai o texto de várias páginas text-only numa única requisição (uma imagem por
+    página na mesma mensagem), dividindo entre elas o custo fixo da chamada.
+    
+    Args:
+        pages: Tuplas (image_path, page_out, page_id)
+        demais: como em extract_text_from_page
+    
+    Returns:
+        Lista (html_path, summary_entry) na ordem de `pages`. Páginas sem payload
+        utilizável na resposta agrupada são refeitas com extract_text_from_page.
+    """
+    # Imagem ausente/truncada derrubaria a requisição agrupada inteira: fica de fora já aqui
+    usable = [_usable_image(image_path, page_id) for image_path, _, page_id in pages]
+    if not all(usable):
+        results = iter(extract_text_batch(
+            [page for page, ok in zip(pages, usable) if ok],
+            model,
+            provider,
+            api_key,
+            azure_endpoint,
+            azure_api_version,
+            openrouter_api_key,
+            locale,
+        ))
+        return [next(results) if ok else (None, None) for ok in usable]
+
+    payloads: List[Optional[Dict[str, Any]]] = [None] * len(pages)
+    if len(pages) > 1:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "📄 Extraindo texto de %d páginas numa requisição (%s)",
+                len(pages),
+                ", ".join(page_id for _, _, page_id in pages),
+            )
+        try:
+            payloads = call_openai_vision_json_grouped(
+                [image_path for image_path, _, _ in pages],
+                model=model,
+                provider=provider,
+                api_key=api_key,
+                azure_endpoint=azure_endpoint,
+                azure_api_version=azure_api_version,
+                openrouter_api_key=openrouter_api_key,
+                locale=locale,
+                instructions=TEXT_EXTRACTION_PROMPT,
+                group_suffix=TEXT_BATCH_SUFFIX,
+            )
+        except Exception as e:
+            logger.warning("Extração de texto agrupada falhou (%s); usando chamadas individuais", e)
+
+    results: List[Tuple[Optional[Path], Optional[Dict[str, str]]]] = []
+    for (image_path, page_out, page_id), payload in zip(pages, payloads):
+        result: Tuple[Optional[Path], Optional[Dict[str, str]]] = (None, None)
+        if payload:
+            try:
+                result = _save_text_payload(payload, page_out, page_id)
+            except Exception as e:
+                logger.error("Erro ao salvar texto da página %s: %s", page_id, e)
+        if result[0] is None:
+            result = extract_text_from_page(
+                image_path,
+                page_out,
+                page_id,
+                model,
+                provider,
+                api_key,
+                azure_endpoint,
+                azure_api_version,
+                openrouter_api_key,
+                locale,
+            )
+        results.append(result)
+    return results
+
+
+def _save_text_payload(
+    payload: Dict[str, Any],
+    page_out: Path,
+    page_id: str,
+) -> tuple[Optional[Path], Optional[Dict[str, str]]]:
+    """Grava page-text.json e page-text.html a partir do payload; retorna (html_path, summary_entry)."""
+    # Salva JSON bruto
+    write_json_pretty(page_out / "page-text.json", payload)
+    
+    # Converte para HTML
+    html_content = _payload_to_html(payload)
+    if not html_content:
+        logger.warning("Falha ao converter payload para HTML (página %s)", page_id)
+        return None, None
+    
+    # Salva HTML
+    title = payload.get("title") or f"Página {page_id}"
+    html_path = _save_text_html(html_content, page_out, title)
+    
+    if html_path:
+        logger.info("✅ Texto extraído e salvo: %s", html_path.name)
+        summary_entry = {
+            "page": page_id,
+            "table": "text",  # Identificador especial para texto
+            "html": html_content,
+        }
+        return html_path, summary_entry
+    
+    return None, None
+
+
 def _payload_to_html(payload: Dict[str, Any]) -> Optional[str]:
     """
     Converte payload JSON em HTML formatado.
@@ -200,42 +405,32 @@ def _payload_to_html(payload: Dict[str, Any]) -> Optional[str]:
     for section in sections:
         section_type = section.get("type")
         
-        if section_type == "heading":
-            level = section.get("level", 2)
-            text = section.get("text", "")
-            if text:
-                # Converte markdown-style para HTML
-                text_html = _format_inline_text(text)
-                html_parts.append(f"<h{level}>{text_html}</h{level}>")
-        
-        elif section_type == "paragraph":
-            text = section.get("text", "")
-            if text:
-                text_html = _format_inline_text(text)
-                html_parts.append(f"<p>{text_html}</p>")
-        
-        elif section_type == "list":
-            items = section.get("items", [])
-            style = section.get("style", "bullet")
+        if section_type == "list":
+            items = section.get("items")
             if items:
-                tag = "ol" if style == "numbered" else "ul"
+                tag = "ol" if section.get("style", "bullet") == "numbered" else "ul"
                 html_parts.append(f"<{tag}>")
                 for item in items:
                     item_html = _format_inline_text(str(item))
                     html_parts.append(f"  <li>{item_html}</li>")
                 html_parts.append(f"</{tag}>")
+            continue
         
-        elif section_type == "blockquote":
-            text = section.get("text", "")
-            if text:
-                text_html = _format_inline_text(text)
-                html_parts.append(f"<blockquote>{text_html}</blockquote>")
-        
-        elif section_type == "reference":
-            text = section.get("text", "")
-            if text:
-                text_html = _format_inline_text(text)
-                html_parts.append(f"<p class='reference'>{text_html}</p>")
+        # Demais tipos: um único texto entre tags; seção vazia ou de tipo desconhecido é pulada
+        text = section.get("text")
+        if not text:
+            continue
+        if section_type == "heading":
+            level = section.get("level", 2)
+            open_tag, close_tag = f"<h{level}>", f"</h{level}>"
+        else:
+            # Tipo não-hashable (lista/dict vindos do modelo) quebraria o .get: seção pulada
+            tags = _TEXT_SECTION_TAGS.get(section_type) if isinstance(section_type, str) else None
+            if tags is None:
+                continue
+            open_tag, close_tag = tags
+        # Converte markdown-style para HTML
+        html_parts.append(f"{open_tag}{_format_inline_text(text)}{close_tag}")
     
     return "\n".join(html_parts)
 
@@ -250,16 +445,18 @@ def _format_inline_text(text: str) -> str:
     Returns:
         HTML escapado com formatação
     """
-    import re
-    
     # Escapa HTML primeiro
     text = escape(text)
     
+    # Sem asterisco não há marcação: a maioria dos trechos sai aqui, sem passar pelos regex
+    if "*" not in text:
+        return text
+    
     # Converte **negrito** para <strong>
-    text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
+    text = _BOLD_RE.sub(r'<strong>\1</strong>', text)
     
     # Converte *itálico* para <em>
-    text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
+    text = _ITALIC_RE.sub(r'<em>\1</em>', text)
     
     return text
 
@@ -282,86 +479,16 @@ def _save_text_html(
     """
     out_dir.mkdir(parents=True, exist_ok=True)
     
-    # Monta HTML completo com CSS
-    full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{
-            font-family: 'Georgia', 'Times New Roman', serif;
-            padding: 40px;
-            max-width: 800px;
-            margin: 0 auto;
-            background: #fafafa;
-            line-height: 1.6;
-        }}
-        .container {{
-            background: #fff;
-            padding: 40px;
-            border-radius: 8px;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        }}
-        h1 {{
-            font-size: 2em;
-            margin-bottom: 20px;
-            color: #2c3e50;
-            border-bottom: 3px solid #3498db;
-            padding-bottom: 10px;
-        }}
-        h2 {{
-            font-size: 1.5em;
-            margin-top: 30px;
-            margin-bottom: 15px;
-            color: #34495e;
-        }}
-        h3 {{
-            font-size: 1.2em;
-            margin-top: 20px;
-            margin-bottom: 10px;
-            color: #555;
-        }}
-        p {{
-            margin-bottom: 15px;
-            text-align: justify;
-            color: #333;
-        }}
-        ul, ol {{
-            margin-bottom: 15px;
-            padding-left: 30px;
-        }}
-        li {{
-            margin-bottom: 8px;
-            color: #333;
-        }}
-        blockquote {{
-            border-left: 4px solid #3498db;
-            margin: 20px 0;
-            padding: 10px 20px;
-            background: #ecf0f1;
-            font-style: italic;
-        }}
-        .reference {{
-            font-size: 0.9em;
-            color: #666;
-            margin-left: 20px;
-        }}
-        strong {{
-            color: #2c3e50;
-        }}
-    </style>
-</head>
-<body>
-<div class="container">
-    <h1>{escape(title)}</h1>
-    {content}
-</div>
-</body>
-</html>"""
+    # Monta HTML completo: só o título e o conteúdo variam por página
+    full_html = b"".join((
+        _TEXT_HTML_HEAD,
+        f"    <h1>{escape(title)}</h1>\n    {content}\n".encode("utf-8"),
+        _TEXT_HTML_TAIL,
+    ))
     
     try:
         html_path = out_dir / "page-text.html"
-        html_path.write_text(full_html, encoding="utf-8")
+        html_path.write_bytes(full_html)
         logger.info("✅ HTML de texto salvo: %s", html_path.name)
         return html_path
     except Exception as e: